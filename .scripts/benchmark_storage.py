@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+
+Standalone benchmark for the kodion.sql_store layer. Runs without Kodi by
+stubbing the xbmc modules before the add-on is imported.
+
+Usage:
+    python3 .scripts/benchmark_storage.py [--rows 10000] [--ops 500]
+                                          [--codecs]
+    python3 .scripts/benchmark_storage.py --suite [--sizes 1000,10000,100000]
+                                          [--ops 500] [--save results.json]
+                                          [--compare baseline.json]
+                                          [--threshold 0.25]
+
+The suite exits with status 1 if the p50 latency of any benchmark is more than
+threshold (as a fraction) and min-delta (in ms) slower than in the compared
+results. Benchmarks with fewer than 10 samples are not compared.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIB_PATH = os.path.join(ROOT, 'resources', 'lib')
+
+
+class _Stub(object):
+    def __init__(self, *_args, **_kwargs):
+        pass
+
+    def __call__(self, *_args, **_kwargs):
+        return _Stub()
+
+    def __getattr__(self, name):
+        return _Stub()
+
+    def __iter__(self):
+        return iter(())
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+    def __int__(self):
+        return 0
+
+    def __str__(self):
+        return ''
+
+    def __mro_entries__(self, bases):
+        return (object,)
+
+
+def _stub_kodi():
+    for name in ('xbmc', 'xbmcaddon', 'xbmcgui', 'xbmcplugin', 'xbmcvfs'):
+        module = types.ModuleType(name)
+        module.__getattr__ = lambda attr: _Stub()
+        sys.modules[name] = module
+
+    xbmc = sys.modules['xbmc']
+    levels = ('LOGDEBUG', 'LOGINFO', 'LOGNOTICE', 'LOGWARNING',
+              'LOGERROR', 'LOGSEVERE', 'LOGFATAL', 'LOGNONE')
+    for level, name in enumerate(levels):
+        setattr(xbmc, name, level)
+    xbmc.log = lambda msg, level=0: None
+    sys.modules['xbmcvfs'].translatePath = lambda path: path
+
+    if LIB_PATH not in sys.path:
+        sys.path.insert(0, LIB_PATH)
+
+
+def video_resource(video_id):
+    return {
+        'kind': 'youtube#video',
+        'etag': 'x' * 27,
+        'id': video_id,
+        'snippet': {
+            'publishedAt': '2024-05-01T12:34:56Z',
+            'channelId': 'UC' + video_id * 2,
+            'title': 'Video title for ' + video_id,
+            'description': 'Lorem ipsum dolor sit amet. ' * 20,
+            'thumbnails': {
+                size: {
+                    'url': 'https://i.ytimg.com/vi/%s/%s.jpg' % (video_id,
+                                                                 size),
+                    'width': width,
+                    'height': height,
+                }
+                for size, width, height in (('default', 120, 90),
+                                            ('medium', 320, 180),
+                                            ('high', 480, 360))
+            },
+            'channelTitle': 'Channel name',
+            'tags': ['tag%d' % idx for idx in range(10)],
+            'categoryId': '22',
+            'liveBroadcastContent': 'none',
+        },
+        'contentDetails': {
+            'duration': 'PT12M34S',
+            'dimension': '2d',
+            'definition': 'hd',
+            'caption': 'false',
+            'licensedContent': True,
+            'projection': 'rectangular',
+        },
+        'statistics': {
+            'viewCount': '123456',
+            'likeCount': '1234',
+            'commentCount': '123',
+        },
+    }
+
+
+def feed_resource(channel_id, num_items=1000):
+    # Video ids are unique to each channel, as they are in the feed index
+    return {
+        'channel_name': 'channel name for ' + channel_id,
+        'videos': [
+            (channel_id[-6:] + '%05d' % idx, 1714567890.0 - 3600 * idx)
+            for idx in range(num_items)
+        ],
+    }
+
+
+def player_js(size=1500000):
+    rand = random.Random(size)
+    names = [''.join(rand.choice('abcdefghijklmnopqrstuvwxyzAB$_')
+                     for _ in range(rand.randint(2, 4)))
+             for _ in range(2000)]
+    statements = (
+        'var {0}=function({1},{2}){{return {1}.{3}({2})}};',
+        '{0}.prototype.{1}=function(){{this.{2}=[];this.{3}=null}};',
+        'if({0}&&{1}.{2}){{{3}({0},"{1}")}}else{{{2}=!0}}',
+        '{0}[{1}]=({2}+{3})%{0}.length;',
+    )
+    parts = []
+    length = 0
+    while length < size:
+        statement = rand.choice(statements).format(*rand.sample(names, 4))
+        parts.append(statement)
+        length += len(statement)
+    return {'url': '/s/player/0123abcd/player_ias.vflset/en_US/base.js',
+            'js': ''.join(parts)}
+
+
+def play_data(idx):
+    return {
+        'play_count': idx % 5,
+        'total_time': 754.0,
+        'played_time': float(idx % 754),
+        'played_percent': (idx % 754) * 100 // 754,
+    }
+
+
+def make_video_id(idx):
+    return '%011d' % idx
+
+
+def make_channel_id(idx):
+    return 'UC%022d' % idx
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    idx = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[idx]
+
+
+def timed(func, iterations, args_func=None, after=None):
+    samples = []
+    for idx in range(iterations):
+        args = args_func(idx) if args_func else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+        if after:
+            after()
+    return samples
+
+
+def report(name, samples):
+    total = sum(samples)
+    summary = {
+        'samples': len(samples),
+        'ops': (len(samples) / total) if total else 0,
+        'mean': 1000 * total / len(samples),
+        'p50': 1000 * percentile(samples, 0.5),
+        'p99': 1000 * percentile(samples, 0.99),
+    }
+    print('{name:<36} {ops:>10.0f} ops/s'
+          '  mean {mean:>8.3f}ms  p50 {p50:>8.3f}ms  p99 {p99:>8.3f}ms'
+          .format(name=name, **summary))
+    return summary
+
+
+def bench_connections(data_path, rows, ops):
+    from youtube_plugin.kodion.sql_store import DataCache
+
+    cache = DataCache((data_path, 'bench', 'data_cache.sqlite'),
+                      max_file_size_mb=0)
+    cache.set_items({
+        make_video_id(idx): video_resource(make_video_id(idx))
+        for idx in range(rows)
+    })
+
+    def _random_id(_idx):
+        return (make_video_id(random.randrange(rows)),)
+
+    def _random_item(_idx):
+        video_id = make_video_id(random.randrange(rows))
+        return video_id, video_resource(video_id)
+
+    print('DataCache with {0} rows, {1} operations each'.format(rows, ops))
+    for pooled in (False, True):
+        # Closing after every operation reproduces the previous behaviour of
+        # opening, configuring, optimising and closing on each access
+        after = None if pooled else cache.close
+        label = 'pooled' if pooled else 'unpooled'
+        report('get_item ({0})'.format(label),
+               timed(cache.get_item, ops, _random_id, after))
+        report('set_item ({0})'.format(label),
+               timed(cache.set_item, ops, _random_item, after))
+    cache.close()
+
+
+def bench_codecs(ops):
+    from youtube_plugin.kodion.sql_store.storage import Storage
+
+    fixtures = (
+        ('video resource', video_resource(make_video_id(0)), ops),
+        ('feed (1000 items)', feed_resource('UC' + 'x' * 22), ops // 10),
+        ('player js', player_js(), ops // 50),
+    )
+    codecs = (
+        ('pickle', Storage.CODEC_PICKLE, -1),
+        ('json', Storage.CODEC_JSON, -1),
+        ('zlib pickle', Storage.CODEC_PICKLE, 0),
+        ('zlib json', Storage.CODEC_JSON, 0),
+    )
+
+    class _Codec(Storage):
+        pass
+
+    print('{0:<18} {1:<12} {2:>10} {3:>12} {4:>12}'
+          .format('fixture', 'codec', 'bytes', 'encode (ms)', 'decode (ms)'))
+    for fixture_name, fixture, iterations in fixtures:
+        iterations = max(iterations, 1)
+        for codec_name, codec, threshold in codecs:
+            _Codec._codec = codec
+            _Codec._compress_threshold = threshold
+            blob = _Codec._encode(None, fixture)[1]
+            encode = timed(_Codec._encode, iterations,
+                           lambda _idx: (None, fixture))
+            decode = timed(_Codec._decode, iterations,
+                           lambda _idx: (blob,))
+            print('{0:<18} {1:<12} {2:>10} {3:>12.3f} {4:>12.3f}'
+                  .format(fixture_name,
+                          codec_name,
+                          len(blob),
+                          1000 * percentile(encode, 0.5),
+                          1000 * percentile(decode, 0.5)))
+
+
+def populate(store, rows, make_key, make_value, batch_size=500):
+    for start in range(0, rows, batch_size):
+        keys = [make_key(idx)
+                for idx in range(start, min(rows, start + batch_size))]
+        store._set_many({key: make_value(key) for key in keys})
+
+
+def bench_suite(data_path, sizes, ops):
+    from youtube_plugin.kodion.sql_store import (
+        DataCache,
+        FeedHistory,
+        PlaybackHistory,
+    )
+    from youtube_plugin.kodion.sql_store.storage import Storage
+
+    class CountLimited(Storage):
+        _table_name = 'storage_v2'
+        _table_updated = False
+        _sql = {}
+
+    results = {}
+
+    def _run(name, *args, **kwargs):
+        results[name] = report(name, timed(*args, **kwargs))
+
+    for rows in sizes:
+        print('\n{0} rows, {1} operations each'.format(rows, ops))
+        path = os.path.join(data_path, str(rows))
+
+        cache = DataCache((path, 'bench', 'data_cache.sqlite'),
+                          max_file_size_mb=0)
+        start = time.perf_counter()
+        populate(cache, rows, make_video_id, video_resource)
+        print('{0:<36} {1:>10.1f}s'.format('populate data cache',
+                                          time.perf_counter() - start))
+        next_idx = [rows]
+
+        def _new_batch(_idx, size=50):
+            idx = next_idx[0]
+            next_idx[0] += size
+            return ({
+                make_video_id(idx + offset): video_resource(
+                    make_video_id(idx + offset)
+                )
+                for offset in range(size)
+            },)
+
+        def _random_ids(_idx, size=50):
+            return ([make_video_id(random.randrange(rows))
+                     for _ in range(size)],)
+
+        _run('{0} _set_many (50 videos)'.format(rows),
+             cache._set_many, ops, _new_batch)
+        _run('{0} _get_by_ids (50 videos)'.format(rows),
+             cache._get_by_ids, ops, _random_ids)
+
+        # Steady state check of the running size total, without evicting
+        stored_kb = cache._get_stored_size() // 1024
+        cache.set_max_file_size_kb(2 * stored_kb)
+        _run('{0} _optimize_file_size (no-op)'.format(rows),
+             cache._optimize_file_size, ops)
+        # Evict half of the rows, on a fresh connection
+        cache.close()
+        cache.set_max_file_size_kb(stored_kb)
+        _run('{0} _optimize_file_size (evict)'.format(rows),
+             cache._optimize_file_size, 1)
+        cache.close()
+
+        limited = CountLimited((path, 'bench', 'count_limited.sqlite'),
+                               max_item_count=rows)
+        populate(limited, rows, make_video_id,
+                 lambda video_id: play_data(int(video_id)))
+        next_idx[0] = rows
+
+        def _add_over_limit(_idx, size=50):
+            batch = {
+                make_video_id(next_idx[0] + offset): play_data(offset)
+                for offset in range(size)
+            }
+            next_idx[0] += size
+            # Bypass the pruning done by _set_many
+            limited._max_item_count = -1
+            limited._set_many(batch)
+            limited._max_item_count = rows
+
+        _run('{0} _optimize_item_count (50 over)'.format(rows),
+             limited._optimize_item_count, ops,
+             lambda idx: _add_over_limit(idx) or ())
+        limited.close()
+
+        feeds = FeedHistory((path, 'bench', 'feeds.sqlite'))
+        for start in range(0, rows, 100):
+            feeds.set_items({
+                make_channel_id(idx): feed_resource(make_channel_id(idx), 15)
+                for idx in range(start, min(rows, start + 100))
+            })
+
+        def _random_feeds(_idx, size=10):
+            return ({
+                make_channel_id(idx): feed_resource(make_channel_id(idx), 15)
+                for idx in (random.randrange(rows) for _ in range(size))
+            },)
+
+        def _random_channels(_idx, size=min(rows, 200)):
+            return ([make_channel_id(idx)
+                     for idx in random.sample(range(rows), size)],)
+
+        def _get_next_page(channel_ids, page_cursor):
+            return feeds.get_feed_page(channel_ids, page_cursor=page_cursor)
+
+        _run('{0} FeedHistory.set_items (10 feeds)'.format(rows),
+             feeds.set_items, ops, _random_feeds)
+        _run('{0} FeedHistory.get_feed_page (first)'.format(rows),
+             feeds.get_feed_page, ops, _random_channels)
+        # Cursors of the first page of the merged feed of random channels
+        page_cursors = []
+        for idx in range(ops):
+            channel_ids, = _random_channels(idx)
+            _, page_cursor = feeds.get_feed_page(channel_ids)
+            page_cursors.append((channel_ids, page_cursor))
+        _run('{0} FeedHistory.get_feed_page (next)'.format(rows),
+             _get_next_page, ops, lambda idx: page_cursors[idx])
+        feeds.close()
+
+        history = PlaybackHistory((path, 'bench', 'history.sqlite'))
+        populate(history, rows, make_video_id,
+                 lambda video_id: play_data(int(video_id)))
+        _run('{0} PlaybackHistory.get_items (50)'.format(rows),
+             history.get_items, ops, _random_ids)
+        _run('{0} PlaybackHistory.get_items (all)'.format(rows),
+             history.get_items, max(1, ops // 50))
+        history.close()
+
+    return results
+
+
+def compare(results, baseline, threshold, min_delta, min_samples=10):
+    regressions = []
+    for name, summary in sorted(results.items()):
+        base = baseline.get(name)
+        # Too few samples to tell a regression apart from noise
+        if (not base or not base['p50']
+                or min(summary['samples'], base['samples']) < min_samples):
+            continue
+        change = summary['p50'] / base['p50'] - 1
+        if change > threshold and summary['p50'] - base['p50'] > min_delta:
+            regressions.append((name, change))
+            print('REGRESSION {0:<36} p50 {1:>8.3f}ms -> {2:>8.3f}ms ({3:+.0%})'
+                  .format(name, base['p50'], summary['p50'], change))
+    if not regressions:
+        print('No regressions over {0:.0%}'.format(threshold))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--ops', type=int, default=500)
+    parser.add_argument('--codecs', action='store_true',
+                        help='compare encoded size and time of each codec')
+    parser.add_argument('--suite', action='store_true',
+                        help='run the regression suite at each of --sizes')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated row counts for the suite')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save suite results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare suite results with saved results')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='max allowed p50 slowdown, as a fraction')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help='ignore p50 slowdowns of less than this many ms')
+    args = parser.parse_args()
+
+    _stub_kodi()
+    random.seed(0)
+
+    data_path = tempfile.mkdtemp(prefix='yt_storage_bench_')
+    try:
+        if args.codecs:
+            bench_codecs(args.ops)
+        elif args.suite:
+            sizes = [int(size) for size in args.sizes.split(',')]
+            results = bench_suite(data_path, sizes, args.ops)
+        else:
+            bench_connections(data_path, args.rows, args.ops)
+    finally:
+        shutil.rmtree(data_path, ignore_errors=True)
+
+    if not args.suite:
+        return 0
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print('')
+        if compare(results, baseline, args.threshold, args.min_delta):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -456,5 +456,9 @@ class AbstractProvider(object):
     def handle_exception(self, context, exception_to_handle):
         return True
 
+    def preload_streams(self, context, video_id):
+        # can be overridden by the derived class
+        return False
+
     def tear_down(self):
         pass
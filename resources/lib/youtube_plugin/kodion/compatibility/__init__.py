@@ -16,6 +16,7 @@ __all__ = (
     'entity_escape',
     'parse_qs',
     'parse_qsl',
+    'perf_counter',
     'quote',
     'string_type',
     'to_str',
@@ -171,6 +172,12 @@ else:
         return datetime_obj.strftime(str_format)
 
 
+try:
+    from time import perf_counter
+except ImportError:
+    from time import time as perf_counter
+
+
 _cpu_count = _sched_get_affinity = None
 try:
     from os import sched_getaffinity as _sched_getaffinity
@@ -90,6 +90,7 @@ PLAYER_DATA = 'player_json'
 PLAYLIST_PATH = 'playlist_path'
 PLAYLIST_POSITION = 'playlist_position'
 REROUTE_PATH = 'reroute_path'
+STORAGE_STATS = 'storage_stats'
 
 __all__ = (
     # Addon paths
@@ -150,6 +151,7 @@ __all__ = (
     'PLAYLIST_PATH',
     'PLAYLIST_POSITION',
     'REROUTE_PATH',
+    'STORAGE_STATS',
 
     # Other constants
     'CONTENT',
@@ -35,3 +35,4 @@ IP = '/youtube/client_ip'
 MPD = '/youtube/manifest/dash'
 PING = '/youtube/ping'
 REDIRECT = '/youtube/redirect'
+STATS = '/youtube/stats'
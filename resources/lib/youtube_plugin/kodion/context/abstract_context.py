@@ -33,15 +33,17 @@ from ..constants import (
 )
 from ..json_store import AccessManager
 from ..sql_store import (
+    ApiQuota,
     BookmarksList,
     DataCache,
     FeedHistory,
     FunctionCache,
     PlaybackHistory,
     SearchHistory,
+    StreamCache,
     WatchLaterList,
 )
-from ..utils import current_system_version
+from ..utils import SingleFlight, current_system_version
 
 
 class AbstractContext(Logger):
@@ -49,6 +51,10 @@ class AbstractContext(Logger):
     _addon = None
     _settings = None
 
+    # Functions returning the counters of other components of the add-on, by
+    # name, that are included in get_storage_stats, see add_stats_source
+    _stats_sources = {}
+
     _BOOL_PARAMS = {
         PLAY_FORCE_AUDIO,
         PLAY_PROMPT_SUBTITLES,
@@ -133,12 +139,14 @@ class AbstractContext(Logger):
         self._access_manager = None
         self._uuid = None
 
+        self._api_quota = None
         self._bookmarks_list = None
         self._data_cache = None
         self._feed_history = None
         self._function_cache = None
         self._playback_history = None
         self._search_history = None
+        self._stream_cache = None
         self._watch_later_list = None
 
         self._plugin_handle = -1
@@ -180,6 +188,8 @@ class AbstractContext(Logger):
     def get_playback_history(self):
         uuid = self.get_uuid()
         if not self._playback_history or self._playback_history.uuid != uuid:
+            if self._playback_history:
+                self._playback_history.close()
             filepath = (self.get_data_path(), uuid, 'history.sqlite')
             self._playback_history = PlaybackHistory(filepath)
         return self._playback_history
@@ -187,6 +197,8 @@ class AbstractContext(Logger):
     def get_feed_history(self):
         uuid = self.get_uuid()
         if not self._feed_history or self._feed_history.uuid != uuid:
+            if self._feed_history:
+                self._feed_history.close()
             filepath = (self.get_data_path(), uuid, 'feeds.sqlite')
             self._feed_history = FeedHistory(filepath)
         return self._feed_history
@@ -194,6 +206,8 @@ class AbstractContext(Logger):
     def get_data_cache(self):
         uuid = self.get_uuid()
         if not self._data_cache or self._data_cache.uuid != uuid:
+            if self._data_cache:
+                self._data_cache.close()
             filepath = (self.get_data_path(), uuid, 'data_cache.sqlite')
             self._data_cache = DataCache(
                 filepath,
@@ -204,6 +218,8 @@ class AbstractContext(Logger):
     def get_function_cache(self):
         uuid = self.get_uuid()
         if not self._function_cache or self._function_cache.uuid != uuid:
+            if self._function_cache:
+                self._function_cache.close()
             filepath = (self.get_data_path(), uuid, 'cache.sqlite')
             self._function_cache = FunctionCache(
                 filepath,
@@ -211,9 +227,20 @@ class AbstractContext(Logger):
             )
         return self._function_cache
 
+    def get_stream_cache(self):
+        uuid = self.get_uuid()
+        if not self._stream_cache or self._stream_cache.uuid != uuid:
+            if self._stream_cache:
+                self._stream_cache.close()
+            filepath = (self.get_data_path(), uuid, 'streams.sqlite')
+            self._stream_cache = StreamCache(filepath)
+        return self._stream_cache
+
     def get_search_history(self):
         uuid = self.get_uuid()
         if not self._search_history or self._search_history.uuid != uuid:
+            if self._search_history:
+                self._search_history.close()
             filepath = (self.get_data_path(), uuid, 'search.sqlite')
             self._search_history = SearchHistory(
                 filepath,
@@ -224,6 +251,8 @@ class AbstractContext(Logger):
     def get_bookmarks_list(self):
         uuid = self.get_uuid()
         if not self._bookmarks_list or self._bookmarks_list.uuid != uuid:
+            if self._bookmarks_list:
+                self._bookmarks_list.close()
             filepath = (self.get_data_path(), uuid, 'bookmarks.sqlite')
             self._bookmarks_list = BookmarksList(filepath)
         return self._bookmarks_list
@@ -231,10 +260,61 @@ class AbstractContext(Logger):
     def get_watch_later_list(self):
         uuid = self.get_uuid()
         if not self._watch_later_list or self._watch_later_list.uuid != uuid:
+            if self._watch_later_list:
+                self._watch_later_list.close()
             filepath = (self.get_data_path(), uuid, 'watch_later.sqlite')
             self._watch_later_list = WatchLaterList(filepath)
         return self._watch_later_list
 
+    def get_api_quota(self):
+        # shared by all users, as quota is used per API key
+        if not self._api_quota:
+            filepath = (self.get_data_path(), 'api_quota.sqlite')
+            self._api_quota = ApiQuota(filepath)
+        return self._api_quota
+
+    def get_storage_stats(self):
+        """
+        Returns the counters of each database opened by this context, see
+        Storage.get_stats, and the counters of the requests collapsed by
+        single flight in this process under 'single_flight', see
+        SingleFlight.get_all_stats, and the counters of any other components
+        added with add_stats_source
+        """
+        stores = {
+            'api_quota': self._api_quota,
+            'bookmarks': self._bookmarks_list,
+            'data_cache': self._data_cache,
+            'feed_history': self._feed_history,
+            'function_cache': self._function_cache,
+            'playback_history': self._playback_history,
+            'search_history': self._search_history,
+            'stream_cache': self._stream_cache,
+            'watch_later': self._watch_later_list,
+        }
+        stats = {
+            name: store.get_stats()
+            for name, store in stores.items()
+            if store
+        }
+        single_flight = SingleFlight.get_all_stats()
+        if single_flight:
+            stats['single_flight'] = single_flight
+        for name, get_stats in self._stats_sources.items():
+            source_stats = get_stats()
+            if source_stats:
+                stats[name] = source_stats
+        return stats
+
+    @classmethod
+    def add_stats_source(cls, name, get_stats):
+        """
+        Includes the counters of a component in get_storage_stats
+        :param str name: key of the counters in the stats
+        :param callable get_stats: returns a dict of counters
+        """
+        cls._stats_sources[name] = get_stats
+
     def get_uuid(self):
         uuid = self._uuid
         if uuid:
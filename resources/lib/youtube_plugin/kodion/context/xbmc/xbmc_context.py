@@ -132,6 +132,7 @@ class XbmcContext(AbstractContext):
         'maintenance.function_cache': 30557,
         'maintenance.playback_history': 30673,
         'maintenance.search_history': 30558,
+        'maintenance.storage_stats': 30821,
         'maintenance.watch_later': 30782,
         'my_channel': 30507,
         'my_location': 30654,
@@ -624,12 +625,14 @@ class XbmcContext(AbstractContext):
         new_context._access_manager = self._access_manager
         new_context._uuid = self._uuid
 
+        new_context._api_quota = self._api_quota
         new_context._bookmarks_list = self._bookmarks_list
         new_context._data_cache = self._data_cache
         new_context._feed_history = self._feed_history
         new_context._function_cache = self._function_cache
         new_context._playback_history = self._playback_history
         new_context._search_history = self._search_history
+        new_context._stream_cache = self._stream_cache
         new_context._watch_later_list = self._watch_later_list
 
         new_context._ui = self._ui
@@ -797,6 +800,24 @@ class XbmcContext(AbstractContext):
 
     def tear_down(self):
         self.clear_settings()
+
+        attrs = (
+            '_api_quota',
+            '_bookmarks_list',
+            '_data_cache',
+            '_feed_history',
+            '_function_cache',
+            '_playback_history',
+            '_search_history',
+            '_stream_cache',
+            '_watch_later_list',
+        )
+        for attr in attrs:
+            store = getattr(self, attr, None)
+            if store:
+                store.close()
+                setattr(self, attr, None)
+
         attrs = (
             '_addon',
             '_settings',
@@ -20,12 +20,27 @@ from ..constants import (
     PLAYBACK_STARTED,
     PLAYBACK_STOPPED,
     PLAYER_DATA,
+    PLAY_FORCE_AUDIO,
+    PLAY_PROMPT_QUALITY,
+    PLAY_PROMPT_SUBTITLES,
     PLAY_WITH,
     REFRESH_CONTAINER,
 )
 
 
 class PlayerMonitorThread(threading.Thread):
+    # Seconds before the end of the current item at which the streams of
+    # the next item of the playlist are loaded
+    _preload_time = 30
+    # Play request params that change how streams are loaded, see
+    # yt_play.process. Items with these params are not preloaded.
+    _play_overrides = frozenset((
+        PLAY_FORCE_AUDIO,
+        PLAY_PROMPT_QUALITY,
+        PLAY_PROMPT_SUBTITLES,
+        PLAY_WITH,
+    ))
+
     def __init__(self, player, provider, context, monitor, player_data):
         super(PlayerMonitorThread, self).__init__()
 
@@ -106,6 +121,7 @@ class PlayerMonitorThread(threading.Thread):
         video_id_param = 'video_id=%s' % self.video_id
         report_url = use_remote_history and playback_stats.get('watchtime_url')
 
+        preloaded = False
         segment_start = 0.0
         report_time = -1.0
         wait_interval = 1
@@ -129,6 +145,11 @@ class PlayerMonitorThread(threading.Thread):
                 self.stop()
                 break
 
+            if (not preloaded
+                    and total_time - played_time <= self._preload_time):
+                preloaded = True
+                self.preload_next()
+
             _seek_time = player.start_time or player.seek_time
             if waited and _seek_time and played_time < _seek_time:
                 waited = 0
@@ -280,6 +301,46 @@ class PlayerMonitorThread(threading.Thread):
 
         self.end()
 
+    def preload_next(self):
+        """
+        Loads the streams of the next item of the playlist in a separate
+        thread, if the item plays a video, so that they are cached by the time
+        the item is played
+        """
+        context = self._context
+        playlist_player = context.get_playlist_player()
+        position, _ = playlist_player.get_position(offset=1)
+        if not position:
+            return
+        items = playlist_player.get_items(properties=('file',))
+        if len(items) < position:
+            return
+        uri = items[position - 1].get('file', '')
+        if not context.is_plugin_path(uri, PATHS.PLAY):
+            return
+        _, params = context.parse_uri(uri)
+        video_id = params.get('video_id')
+        if (not video_id
+                or video_id == self.video_id
+                or not self._play_overrides.isdisjoint(params)):
+            return
+
+        thread = threading.Thread(target=self._preload, args=(video_id,))
+        thread.daemon = True
+        thread.start()
+
+    def _preload(self, video_id):
+        context = self._context
+        context.log_debug('PlayerMonitorThread[{0}]: Preloading next item'
+                          ' [{1}]'
+                          .format(self.video_id, video_id))
+        success = self._provider.preload_streams(context, video_id)
+        context.log_debug('PlayerMonitorThread[{0}]: Preloading next item'
+                          ' [{1}] {2}'
+                          .format(self.video_id,
+                                  video_id,
+                                  'done' if success else 'failed'))
+
     def stop(self):
         self._context.log_debug('PlayerMonitorThread[{0}]: Stop event set'
                                 .format(self.video_id))
@@ -32,8 +32,10 @@ from ..constants import (
     LICENSE_TOKEN,
     LICENSE_URL,
     PATHS,
+    STORAGE_STATS,
     TEMP_PATH,
 )
+from ..sql_store.storage import Storage
 from ..utils import redact_ip, validate_ip_address, wait
 
 
@@ -230,6 +232,24 @@ class RequestHandler(BaseHTTPRequestHandler, object):
         elif stripped_path == PATHS.PING:
             self.send_error(204)
 
+        elif stripped_path == PATHS.STATS:
+            plugin_stats = context.get_ui().get_property(STORAGE_STATS)
+            try:
+                plugin_stats = json.loads(plugin_stats) if plugin_stats else {}
+            except ValueError:
+                plugin_stats = {}
+            service_stats = context.get_storage_stats()
+            stats_json = json.dumps({
+                'plugin': plugin_stats,
+                'service': service_stats,
+                'total': Storage.merge_stats(plugin_stats, service_stats),
+            })
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(stats_json)))
+            self.end_headers()
+            self.wfile.write(stats_json.encode('utf-8'))
+
         elif stripped_path.startswith(PATHS.REDIRECT):
             url = dict(parse_qsl(urlsplit(self.path).query)).get('url')
             if url:
@@ -654,6 +674,22 @@ def get_client_ip_address(context):
     return ip_address
 
 
+def get_storage_stats(context):
+    url = urlunsplit((
+        'http',
+        get_connect_address(context, as_netloc=True),
+        PATHS.STATS,
+        '',
+        '',
+    ))
+    if not RequestHandler.requests:
+        RequestHandler.requests = BaseRequestsClass(context=context)
+    response = RequestHandler.requests.request(url)
+    if response and response.status_code == 200:
+        return response.json()
+    return None
+
+
 def get_connect_address(context, as_netloc=False):
     settings = context.get_settings()
     listen_address = settings.httpd_listen()
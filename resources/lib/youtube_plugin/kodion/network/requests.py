@@ -11,14 +11,17 @@ from __future__ import absolute_import, division, unicode_literals
 
 import atexit
 import socket
+from threading import Lock, Thread
 from traceback import format_stack
 
 from requests import Session
 from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import InvalidJSONError, RequestException
 from requests.utils import DEFAULT_CA_BUNDLE_PATH, extract_zipped_paths
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.util.ssl_ import create_urllib3_context
 
+from ..compatibility import perf_counter
 from ..logger import Logger
 
 
@@ -28,6 +31,36 @@ __all__ = (
 )
 
 
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    """
+    Records the time spent waiting for a free connection from the pool, per
+    host, see BaseRequestsClass.get_pool_stats
+    """
+    stats = {}
+    stats_lock = Lock()
+
+    def _get_conn(self, timeout=None):
+        start = perf_counter()
+        conn = super(_TimedHTTPSConnectionPool, self)._get_conn(timeout)
+        waited = perf_counter() - start
+        with self.stats_lock:
+            stats = self.stats.get(self.host)
+            if not stats:
+                stats = self.stats[self.host] = {
+                    'requests': 0,
+                    'connections': 0,
+                    'wait_time': 0,
+                    'max_wait': 0,
+                }
+            stats['requests'] += 1
+            stats['connections'] = max(stats['connections'],
+                                       self.num_connections)
+            stats['wait_time'] += waited
+            if waited > stats['max_wait']:
+                stats['max_wait'] = waited
+        return conn
+
+
 class SSLHTTPAdapter(HTTPAdapter):
     _SOCKET_OPTIONS = (
         (socket.SOL_SOCKET, getattr(socket, 'SO_KEEPALIVE', None), 1),
@@ -56,7 +89,11 @@ class SSLHTTPAdapter(HTTPAdapter):
             if socket_option[1] is not None
         ]
 
-        return super(SSLHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        super(SSLHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': HTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
 
     def cert_verify(self, conn, url, verify, cert):
         self._ssl_context.check_hostname = bool(verify)
@@ -64,16 +101,23 @@ class SSLHTTPAdapter(HTTPAdapter):
 
 
 class BaseRequestsClass(Logger):
+    _retries = Retry(
+        total=3,
+        backoff_factor=0.1,
+        status_forcelist={500, 502, 503, 504},
+        allowed_methods=None,
+    )
+    # Max number of connections kept open to each host, unless increased for
+    # a host using set_pool_size
+    _pool_size = 10
+    _pool_sizes = {}
+    _pool_lock = Lock()
+
     _session = Session()
     _session.mount('https://', SSLHTTPAdapter(
-        pool_maxsize=10,
+        pool_maxsize=_pool_size,
         pool_block=True,
-        max_retries=Retry(
-            total=3,
-            backoff_factor=0.1,
-            status_forcelist={500, 502, 503, 504},
-            allowed_methods=None,
-        )
+        max_retries=_retries,
     ))
     atexit.register(_session.close)
 
@@ -96,6 +140,95 @@ class BaseRequestsClass(Logger):
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
         self._session.close()
 
+    @classmethod
+    def set_pool_size(cls, host, max_connections):
+        """
+        Increases the max number of connections kept open to a host, so that
+        the given number of threads can make concurrent requests to the host
+        without waiting for a connection to be returned to the pool.
+        The pool is only replaced if more connections are needed, as the idle
+        connections kept open by the replaced pool are closed.
+        :param str host: hostname, such as www.youtube.com
+        :param int max_connections: number of concurrent requests to the host
+        :return: True if the pool was resized, False otherwise
+        """
+        if max_connections <= cls._pool_sizes.get(host, cls._pool_size):
+            return False
+        with cls._pool_lock:
+            if max_connections <= cls._pool_sizes.get(host, cls._pool_size):
+                return False
+            cls._pool_sizes[host] = max_connections
+
+            # Requests uses the adapter with the longest matching prefix.
+            # Adapters are replaced rather than modified in place, as other
+            # threads may be iterating over them.
+            prefix = 'https://{0}/'.format(host)
+            session = cls._session
+            adapters = session.adapters.copy()
+            replaced = adapters.get(prefix)
+            adapters[prefix] = SSLHTTPAdapter(
+                pool_maxsize=max_connections,
+                pool_block=True,
+                max_retries=cls._retries,
+            )
+            for key in [key for key in adapters if len(key) < len(prefix)]:
+                adapters[key] = adapters.pop(key)
+            session.adapters = adapters
+            # Close the idle connections of the replaced pool. Connections
+            # still in use are closed when released back to the closed pool.
+            if replaced:
+                replaced.close()
+        return True
+
+    @classmethod
+    def get_pool_stats(cls):
+        """
+        :return: dict keyed by host, of the max number of connections kept
+                 open to the host, number of requests and connections made,
+                 and total and max seconds spent waiting for a connection
+        """
+        with _TimedHTTPSConnectionPool.stats_lock:
+            stats = {
+                host: dict(host_stats)
+                for host, host_stats in _TimedHTTPSConnectionPool.stats.items()
+            }
+        for host, host_stats in stats.items():
+            host_stats['max_connections'] = cls._pool_sizes.get(
+                host, cls._pool_size
+            )
+        return stats
+
+    def warm_up(self, urls, connections=1):
+        """
+        Opens connections to the hosts of the given urls in the background,
+        so that the first requests to each host do not have to wait for the
+        connection and TLS handshake. Connections are kept in the pool of
+        each host until used, or closed by the server.
+        Pools belong to the session of the current interpreter, so this only
+        benefits requests made by the same process, such as requests made by
+        the service, not requests made by plugin invocations.
+        :param urls: iterable of urls requested with a HEAD request
+        :param int connections: number of connections to open to each url
+        """
+        def _warm_up(url):
+            try:
+                self._session.request('HEAD', url,
+                                      timeout=self._timeout,
+                                      allow_redirects=False,
+                                      proxies=self._proxy,
+                                      verify=self._verify)
+            except RequestException as exc:
+                self.log_debug('Requests - Warm up failed'
+                               '\n\tURL:       {url}'
+                               '\n\tException: {exc!r}'
+                               .format(url=url, exc=exc))
+
+        for url in urls:
+            for _ in range(connections):
+                thread = Thread(target=_warm_up, args=(url,))
+                thread.daemon = True
+                thread.start()
+
     def request(self, url, method='GET',
                 params=None, data=None, headers=None, cookies=None, files=None,
                 auth=None, timeout=None, allow_redirects=None, proxies=None,
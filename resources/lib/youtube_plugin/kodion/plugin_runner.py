@@ -10,7 +10,9 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
-from .constants import CHECK_SETTINGS
+import json
+
+from .constants import CHECK_SETTINGS, STORAGE_STATS
 from .context import XbmcContext
 from .debug import Profiler
 from .plugin import XbmcPlugin
@@ -66,5 +68,12 @@ def run(context=_context,
 
     plugin.run(provider, context, focused=(current_uri == new_uri))
 
+    # Quota used by the requests of this invocation is written in one go
+    context.get_api_quota().flush()
+
+    # Published for the service, which aggregates it with its own counters
+    context.get_ui().set_property(STORAGE_STATS,
+                                  json.dumps(context.get_storage_stats()))
+
     if debug:
         profiler.print_stats()
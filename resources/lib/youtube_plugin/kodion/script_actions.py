@@ -23,7 +23,12 @@ from .constants import (
     WAIT_END_FLAG,
 )
 from .context import XbmcContext
-from .network import Locator, get_client_ip_address, httpd_status
+from .network import (
+    Locator,
+    get_client_ip_address,
+    get_storage_stats,
+    httpd_status,
+)
 from .utils import rm_dir, validate_ip_address
 from ..youtube import Provider
 
@@ -224,8 +229,99 @@ def _config_actions(context, action, *_args):
         settings.set_region(region_id)
 
 
+def _format_storage_stats(stats):
+    lines = []
+    for source in ('total', 'plugin', 'service'):
+        stores = stats.get(source)
+        if not stores:
+            continue
+        lines.append('[B]{0}[/B]'.format(source.capitalize()))
+        for name, counters in sorted(stores.items()):
+            if name in {'player_clients', 'single_flight'}:
+                continue
+            hits = counters.get('hits', 0)
+            requests = hits + counters.get('misses', 0) + counters.get(
+                'expired', 0
+            )
+            memory_cache = counters.get('memory_cache') or {}
+            lines.append(
+                '{name}: {hit_ratio:.0%} hits ({hits}/{requests}),'
+                ' {expired} expired,'
+                ' {read:.1f}/{written:.1f} KiB read/written,'
+                ' {decode_time:.3f}s decoding,'
+                ' {evictions} evicted, {expired_removed} expired removed,'
+                ' {memory_hits} memory cache hits'
+                .format(
+                    name=name,
+                    hit_ratio=(hits / requests) if requests else 0,
+                    hits=hits,
+                    requests=requests,
+                    expired=counters.get('expired', 0),
+                    read=counters.get('bytes_read', 0) / 1024,
+                    written=counters.get('bytes_written', 0) / 1024,
+                    decode_time=counters.get('decode_time', 0),
+                    evictions=counters.get('evictions', 0),
+                    expired_removed=counters.get('expired_removed', 0),
+                    memory_hits=memory_cache.get('hits', 0),
+                )
+            )
+            if 'feeds_modified' in counters:
+                lines[-1] += (
+                    ', {modified}/{not_modified} feeds modified/not modified'
+                    .format(modified=counters['feeds_modified'],
+                            not_modified=counters.get('feeds_not_modified', 0))
+                )
+        clients = stores.get('player_clients', {})
+        for name, counters in sorted(clients.items()):
+            requests = counters.get('requests', 0)
+            lines.append(
+                'player_clients.{name}: {requests} requests,'
+                ' {ok} playable, {abandoned} abandoned,'
+                ' {time:.3f}s average'
+                .format(
+                    name=name,
+                    requests=requests,
+                    ok=counters.get('ok', 0),
+                    abandoned=counters.get('abandoned', 0),
+                    time=(counters.get('time', 0) / requests
+                          if requests else 0),
+                )
+            )
+        for name, counters in sorted(stores.get('single_flight', {}).items()):
+            lines.append(
+                'single_flight.{name}: {collapsed}/{total} requests collapsed'
+                .format(
+                    name=name,
+                    collapsed=counters.get('collapsed', 0),
+                    total=(counters.get('requests', 0)
+                           + counters.get('collapsed', 0)),
+                )
+            )
+        lines.append('')
+    return '[CR]'.join(lines)
+
+
+def _format_quota_usage(usage):
+    lines = ['[B]API quota[/B]']
+    for key_id, key_usage in sorted(usage.items()):
+        lines.append('{key_id}: {total} units'.format(
+            key_id=key_id,
+            total=key_usage['total'],
+        ))
+        calls = sorted(key_usage['calls'].items(),
+                       key=lambda call: call[1][1],
+                       reverse=True)
+        for name, (count, units) in calls:
+            lines.append('    {name}: {units} units ({count} requests)'.format(
+                name=name,
+                units=units,
+                count=count,
+            ))
+    return '[CR]'.join(lines)
+
+
 def _maintenance_actions(context, action, params):
-    target = params.get('target')
+    target = params.get('target') if params else None
 
     ui = context.get_ui()
     localize = context.localize
@@ -245,6 +341,9 @@ def _maintenance_actions(context, action, params):
 
         if ui.on_clear_content(localize('maintenance.{0}'.format(target))):
             targets[target]().clear()
+            # cached streams are part of the data cache for the user
+            if target == 'data_cache':
+                context.get_stream_cache().clear()
             ui.show_notification(localize('completed'))
 
     elif action == 'refresh':
@@ -289,6 +388,22 @@ def _maintenance_actions(context, action, params):
         else:
             return
 
+    elif action == 'stats':
+        context.wakeup(SERVER_WAKEUP, timeout=5)
+        if not httpd_status(context):
+            ui.show_notification(localize('httpd.not.running'))
+            return
+
+        stats = get_storage_stats(context)
+        if stats:
+            text = _format_storage_stats(stats)
+            usage = context.get_api_quota().get_usage()
+            if usage:
+                text = '[CR]'.join((text, _format_quota_usage(usage)))
+            ui.show_text(localize('maintenance.storage_stats'), text)
+        else:
+            ui.show_notification(localize('failed'))
+
     elif action == 'delete':
         path = params.get('path')
         targets = {
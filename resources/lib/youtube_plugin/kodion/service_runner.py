@@ -10,6 +10,10 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from threading import Event, Thread
+from time import time
+from traceback import format_exc
+
 from .constants import (
     ABORT_FLAG,
     PLUGIN_SLEEPING,
@@ -17,7 +21,9 @@ from .constants import (
     VIDEO_ID,
 )
 from .context import XbmcContext
+from .logger import Logger
 from .monitors import PlayerMonitor, ServiceMonitor
+from .network import BaseRequestsClass
 from .utils import rm_dir
 from ..youtube.provider import Provider
 
@@ -25,6 +31,116 @@ from ..youtube.provider import Provider
 __all__ = ('run',)
 
 
+def _maintenance(context):
+    """
+    Chains the maintenance steps of all databases, see Storage.maintenance
+    """
+    getters = (
+        context.get_api_quota,
+        context.get_data_cache,
+        context.get_function_cache,
+        context.get_feed_history,
+        context.get_playback_history,
+        context.get_search_history,
+        context.get_stream_cache,
+        context.get_bookmarks_list,
+        context.get_watch_later_list,
+    )
+    for get_store in getters:
+        for removed in get_store().maintenance():
+            yield removed
+
+
+def _prefetch_feeds(context,
+                    provider,
+                    lead_time,
+                    batch_size,
+                    sync_interval,
+                    abort_check=None):
+    """
+    Syncs the subscription list of the user, if not synced within the last
+    sync_interval seconds, then refreshes the subscription feeds that are due
+    to be refreshed within lead_time seconds, one batch of channels per step.
+    Steps make network requests, and are run by a _StepWorker. The sync is
+    abandoned between pages of subscriptions if abort_check returns True.
+    """
+    client = provider.get_client(context)
+    if provider.is_logged_in():
+        yield client.sync_subscriptions(max_age=sync_interval,
+                                        abort_check=abort_check,
+                                        notify=False,
+                                        background=True)
+
+    channel_ids = context.get_feed_history().get_stale_channels(lead_time)
+    if not channel_ids:
+        return
+    for idx in range(0, len(channel_ids), batch_size):
+        yield client.refresh_feeds(channel_ids[idx:idx + batch_size])
+
+
+class _StepWorker(Thread):
+    """
+    Runs the steps of a generator on a worker thread, one step each time
+    step() is called, so that steps that make network requests do not block
+    the service loop
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        """
+        :param callable func: generator function, called with the given args
+                              and an abort_check keyword argument, that can
+                              be used to end long steps once stopped
+        """
+        super(_StepWorker, self).__init__()
+
+        self._step = Event()
+        self._stopped = Event()
+        self._steps = func(*args, abort_check=self.stopped, **kwargs)
+
+        self.daemon = True
+        self.start()
+
+    def run(self):
+        steps = self._steps
+        try:
+            while not self._stopped.is_set():
+                self._step.wait()
+                if self._stopped.is_set():
+                    break
+                try:
+                    if next(steps, None) is None:
+                        break
+                finally:
+                    # Requests for a step made while the previous step was
+                    # running are ignored
+                    self._step.clear()
+        except Exception:
+            Logger.log_error('Service._StepWorker - Error'
+                             '\n\tStack trace (most recent call last):'
+                             '\n{stack}'
+                             .format(stack=format_exc()))
+        finally:
+            self._stopped.set()
+            steps.close()
+
+    def step(self):
+        """
+        Starts the next step, unless the previous step is still running
+        :return: False once all steps have run, or the worker was stopped
+        """
+        if self._stopped.is_set():
+            return False
+        self._step.set()
+        return True
+
+    def stop(self):
+        self._stopped.set()
+        self._step.set()
+
+    def stopped(self):
+        return self._stopped.is_set()
+
+
 def run():
     context = XbmcContext()
     provider = Provider()
@@ -54,6 +170,15 @@ def run():
     # wipe add-on temp folder on updates/restarts (subtitles, and mpd files)
     rm_dir(TEMP_PATH)
 
+    # pre-open connections to the Data API host, and to the host of youtubei
+    # and RSS feed requests. Only used by requests made by the service, such
+    # as feed prefetching and preloading of streams, as plugin invocations
+    # run in a separate interpreter with their own connection pools.
+    BaseRequestsClass(context=context).warm_up((
+        'https://www.googleapis.com/',
+        'https://www.youtube.com/',
+    ))
+
     loop_period = 10
     loop_period_ms = loop_period * 1000
 
@@ -67,6 +192,21 @@ def run():
     plugin_idle_time_ms = 0
     plugin_idle_timeout_ms = 30000
 
+    maintenance = None
+    maintenance_time_ms = maintenance_period_ms = 3600000
+    # Max time spent on database maintenance per loop period
+    maintenance_slice = 0.2
+
+    feeds_prefetch = None
+    feeds_prefetch_time_ms = feeds_prefetch_period_ms = 300000
+    # Feeds are refreshed in advance of being due when next listed, at a rate
+    # of one batch of channels per loop period
+    feeds_prefetch_lead_time = 15 * 60
+    feeds_prefetch_batch_size = 5
+    # The cached subscription list is synced before prefetching, at most once
+    # per interval
+    subscriptions_sync_interval = 60 * 60
+
     active_interval_ms = 100
     idle_interval_ms = 1000
 
@@ -115,6 +255,41 @@ def run():
                 else:
                     monitor.shutdown_httpd()
 
+        if is_asleep and feeds_prefetch:
+            feeds_prefetch.stop()
+            feeds_prefetch = None
+
+        # Quota used by requests made by the service is written once per loop
+        # period, rather than by each request
+        context.get_api_quota().flush()
+
+        if is_asleep or not is_idle or player.isPlaying():
+            pass
+        elif maintenance:
+            deadline = time() + maintenance_slice
+            for _ in maintenance:
+                if time() >= deadline:
+                    break
+            else:
+                maintenance = None
+        elif maintenance_time_ms >= maintenance_period_ms:
+            maintenance_time_ms = 0
+            maintenance = _maintenance(context)
+        elif feeds_prefetch:
+            if not feeds_prefetch.step():
+                feeds_prefetch = None
+        elif feeds_prefetch_time_ms >= feeds_prefetch_period_ms:
+            feeds_prefetch_time_ms = 0
+            feeds_prefetch = _StepWorker(
+                _prefetch_feeds,
+                context,
+                provider,
+                feeds_prefetch_lead_time,
+                feeds_prefetch_batch_size,
+                subscriptions_sync_interval,
+            )
+            feeds_prefetch.step()
+
         check_item = not plugin_is_idle and container['is_plugin']
         if check_item:
             wait_interval_ms = active_interval_ms
@@ -162,6 +337,8 @@ def run():
             wait_time_ms += wait_interval_ms
             httpd_idle_time_ms += wait_interval_ms
             plugin_idle_time_ms += wait_interval_ms
+            maintenance_time_ms += wait_interval_ms
+            feeds_prefetch_time_ms += wait_interval_ms
 
             if wait_time_ms >= loop_period_ms:
                 break
@@ -170,6 +347,9 @@ def run():
 
     set_property(ABORT_FLAG)
 
+    if feeds_prefetch:
+        feeds_prefetch.stop()
+
     # clean up any/all playback monitoring threads
     player.cleanup_threads(only_ended=False)
 
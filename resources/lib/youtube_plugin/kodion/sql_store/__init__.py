@@ -7,21 +7,25 @@
     See LICENSES/GPL-2.0-only for more information.
 """
 
+from .api_quota import ApiQuota
 from .bookmarks_list import BookmarksList
 from .data_cache import DataCache
 from .feed_history import FeedHistory
 from .function_cache import FunctionCache
 from .playback_history import PlaybackHistory
 from .search_history import SearchHistory
+from .stream_cache import StreamCache
 from .watch_later_list import WatchLaterList
 
 
 __all__ = (
+    'ApiQuota',
     'BookmarksList',
     'DataCache',
     'FeedHistory',
     'FunctionCache',
     'PlaybackHistory',
     'SearchHistory',
+    'StreamCache',
     'WatchLaterList',
 )
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from threading import Lock
+from time import gmtime, strftime, time
+
+from .storage import Storage
+
+
+class ApiQuota(Storage):
+    """
+    Records the Data API quota units used each day, per API key, along with
+    the number of requests and units used by each type of request. Usage is
+    shared by all users and all processes of the add-on.
+    Usage is recorded in memory, and only written to the database by flush(),
+    so requests do not wait on a write lock that is shared with other
+    processes. Usage that has not yet been written by other processes is
+    not included in get_usage().
+    """
+    _table_name = 'storage_v2'
+    _table_updated = False
+    _sql = {}
+
+    _max_age = Storage.ONE_WEEK
+    # Quota is reset at midnight Pacific Time. Daylight saving time is not
+    # accounted for, so days may be off by an hour in summer.
+    _day_offset = -8 * 60 * 60
+
+    def __init__(self, filepath, **kwargs):
+        super(ApiQuota, self).__init__(filepath, **kwargs)
+        # Usage recorded since last written to the database, by usage key
+        self._pending = {}
+        self._pending_lock = Lock()
+
+    @classmethod
+    def get_day(cls, timestamp=None):
+        """
+        :return: date of the current quota day, as YYYY-MM-DD
+        """
+        if timestamp is None:
+            timestamp = time()
+        return strftime('%Y-%m-%d', gmtime(timestamp + cls._day_offset))
+
+    @staticmethod
+    def _usage_key(key_id, day):
+        return '.'.join((day, key_id))
+
+    @staticmethod
+    def _add_usage(usage, other):
+        usage['total'] += other['total']
+        calls = usage['calls']
+        for name, (count, units) in other['calls'].items():
+            total_count, total_units = calls.get(name, (0, 0))
+            calls[name] = (total_count + count, total_units + units)
+        return usage
+
+    def record(self, key_id, name, units):
+        """
+        Adds the units used by a request to the usage of the current day, in
+        memory, see flush()
+        :param str key_id: id of the API key the request was made with
+        :param str name: type of request
+        :param int units: quota cost of the request
+        """
+        key = self._usage_key(key_id, self.get_day())
+        with self._pending_lock:
+            usage = self._pending.get(key)
+            if usage is None:
+                usage = self._pending[key] = {'total': 0, 'calls': {}}
+            self._add_usage(usage, {
+                'total': units,
+                'calls': {name: (1, units)},
+            })
+
+    def flush(self):
+        """
+        Adds the usage recorded since last written to the stored usage. All
+        usage is read and updated in a single write transaction, so that the
+        usage written by other processes is not lost.
+        :return: True if any usage was written, False otherwise
+        """
+        with self._pending_lock:
+            pending = self._pending
+            if not pending:
+                return False
+            self._pending = {}
+        with self as (db, cursor), db:
+            self._execute(cursor, 'BEGIN IMMEDIATE')
+            for key, usage in pending.items():
+                result = self._execute(cursor, self._sql['get'], [key])
+                item = result.fetchone() if result else None
+                if item:
+                    usage = self._add_usage(self._load(item), usage)
+                self._execute(cursor,
+                              self._sql['set'],
+                              values=self._encode(key, usage))
+        return True
+
+    def close(self):
+        self.flush()
+        super(ApiQuota, self).close()
+
+    def get_usage(self, key_id=None, day=None):
+        """
+        :param str|None key_id: id of the API key, or None for all keys
+        :param str|None day: date as YYYY-MM-DD, the current day by default
+        :return: usage of the key on the day, a dict of total units used, and
+                 of number of requests and units used by type of request, or a
+                 dict of usage keyed by key id if no key id is given
+        """
+        day = day or self.get_day()
+        if key_id:
+            key = self._usage_key(key_id, day)
+            usage = self._get(key) or {'total': 0, 'calls': {}}
+            with self._pending_lock:
+                if key in self._pending:
+                    self._add_usage(usage, self._pending[key])
+            return usage
+        result = self._get_by_ids((self._usage_key('%', day),),
+                                  wildcard=True,
+                                  as_dict=True,
+                                  values_only=True)
+        prefix = self._usage_key('', day)
+        with self._pending_lock:
+            for key, pending in self._pending.items():
+                if key.startswith(prefix):
+                    usage = result.setdefault(key, {'total': 0, 'calls': {}})
+                    self._add_usage(usage, pending)
+        return {
+            key.split('.', 1)[1]: usage
+            for key, usage in result.items()
+        }
+
+    def _optimize_item_count(self, limit=-1, defer=False):
+        return False
+
+    def _optimize_file_size(self, limit=-1, defer=False):
+        return False
@@ -18,6 +18,10 @@ class DataCache(Storage):
     _table_updated = False
     _sql = {}
 
+    _compress_threshold = 1024
+    _max_age = Storage.ONE_MONTH
+    _memory_cache_size = 2 * 1024 * 1024
+
     def __init__(self, filepath, max_file_size_mb=5):
         max_file_size_kb = max_file_size_mb * 1024
         super(DataCache, self).__init__(filepath,
@@ -9,16 +9,99 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from heapq import heapify, heappop, heapreplace
+from zlib import crc32
+
 from .storage import Storage
+from ..utils.datetime_parser import since_epoch
 
 
 class FeedHistory(Storage):
+    """
+    Stores the details of each channel feed, keyed by channel id, along with
+    an index of the videos of all feeds, ordered by channel and date
+    published, so that a page of the combined feed can be read without
+    loading and sorting the videos of every channel.
+    """
     _table_name = 'storage_v2'
     _table_updated = False
-    _sql = {}
+    _sql = {
+        '_partial': True,
+        # Videos of a channel are removed from the index along with the
+        # channel, whether removed when expired, or cleared
+        'create_index': (
+            'CREATE INDEX'
+            ' IF NOT EXISTS idx_{table}_timestamp'
+            ' ON {table} (timestamp, size);'
+            'CREATE TABLE'
+            ' IF NOT EXISTS {table}_feed ('
+            '  video_id TEXT PRIMARY KEY,'
+            '  channel_id TEXT,'
+            '  published REAL'
+            ' );'
+            'CREATE INDEX'
+            ' IF NOT EXISTS idx_{table}_feed_channel'
+            ' ON {table}_feed (channel_id, published);'
+            'CREATE TRIGGER'
+            ' IF NOT EXISTS {table}_feed_remove'
+            ' AFTER DELETE ON {table}'
+            ' BEGIN'
+            '  DELETE'
+            '  FROM {table}_feed'
+            '  WHERE channel_id = OLD.key;'
+            ' END;'
+        ),
+        'feed_get_channel': (
+            'SELECT video_id, published'
+            ' FROM {table}_feed'
+            ' WHERE channel_id = ?'
+            ' ORDER BY published DESC'
+            ' LIMIT ?'
+            ' OFFSET ?;'
+        ),
+        'feed_prune': (
+            'DELETE'
+            ' FROM {table}_feed'
+            ' WHERE rowid IN ('
+            '  SELECT rowid'
+            '  FROM {table}_feed'
+            '  WHERE channel_id = ?'
+            '  ORDER BY published DESC'
+            '  LIMIT -1'
+            '  OFFSET {{0}}'
+            ' );'
+        ),
+        'feed_set': (
+            'REPLACE'
+            ' INTO {table}_feed'
+            ' (video_id, channel_id, published)'
+            ' VALUES (?,?,?);'
+        ),
+    }
+
+    _compress_threshold = 1024
+    _max_age = Storage.ONE_MONTH
+    # Max number of videos kept in the index for each channel
+    _max_channel_videos = 1000
+    # Number of videos of each channel read at a time when merging feeds
+    _feed_chunk_size = 10
+    # Bounds of the interval between refreshes of a feed
+    _min_refresh_interval = Storage.ONE_HOUR
+    _max_refresh_interval = Storage.ONE_DAY
+    # Number of most recent videos used to estimate the interval between
+    # uploads of a channel, and fraction of that interval after which its
+    # feed is due to be refreshed
+    _upload_rate_samples = 10
+    _refresh_interval_factor = 0.25
+    # Key of the row recording the channels of the last listing of the
+    # combined feed. Not a valid channel id.
+    _channels_key = 'channels'
 
     def __init__(self, filepath):
         super(FeedHistory, self).__init__(filepath)
+        # Responses to conditional requests for feeds, see update_feeds()
+        self._stats['feeds_modified'] = 0
+        self._stats['feeds_not_modified'] = 0
 
     def get_items(self, content_ids, seconds=None):
         result = self._get_by_ids(content_ids,
@@ -31,8 +114,275 @@ class FeedHistory(Storage):
         result = self._get(content_id, seconds=seconds, as_dict=True)
         return result
 
+    @staticmethod
+    def _split_videos(items):
+        """
+        :return: tuple of dict of copies of the feed details without videos,
+                 and list of (video id, channel id, timestamp) tuples
+        """
+        feeds = {}
+        videos = []
+        for channel_id, details in items.items():
+            details = details.copy()
+            channel_videos = details.pop('videos', None)
+            feeds[channel_id] = details
+            if channel_videos:
+                videos.extend([
+                    (video_id, channel_id, timestamp)
+                    for video_id, timestamp in channel_videos
+                ])
+        return feeds, videos
+
+    def _set_videos(self, cursor, videos, channel_ids):
+        """
+        Merges videos into the feed index, and removes the oldest videos of
+        the given channels above the max number kept. Must be called while
+        holding the lock, within a transaction.
+        """
+        self._execute(cursor, self._sql['feed_set'],
+                      many=True,
+                      values=videos)
+        self._execute(cursor,
+                      self._sql['feed_prune'].format(
+                          self._max_channel_videos
+                      ),
+                      many=True,
+                      values=[(channel_id,) for channel_id in channel_ids])
+
     def set_items(self, items):
-        self._set_many(items)
+        """
+        Stores the details of channel feeds, and merges the videos of each
+        feed into the feed index
+        :param dict items: dict of feed details keyed by channel id. Videos are
+                           given by a 'videos' list of (video id, timestamp)
+                           tuples, and are not stored with the details.
+        """
+        feeds, videos = self._split_videos(items)
+        if not feeds:
+            return
+        self._set_many(feeds)
+        if not videos:
+            return
+
+        with self as (db, cursor), db:
+            self._execute(cursor, 'BEGIN')
+            self._set_videos(cursor, videos, feeds)
+
+    def _refresh_interval(self, cursor, channel_id, now):
+        """
+        Estimates the interval between uploads of a channel from the date
+        published of its most recent videos in the index, including the time
+        since the last upload, so that the estimate grows while a channel is
+        inactive. The feed is next refreshed after a fraction of the estimate,
+        within the min and max refresh intervals.
+        Must be called while holding the lock.
+        """
+        timestamps = [
+            timestamp
+            for _, timestamp in self._execute(
+                cursor,
+                self._sql['feed_get_channel'],
+                (channel_id, self._upload_rate_samples, 0),
+            )
+        ]
+        if not timestamps:
+            return self._max_refresh_interval
+        upload_interval = (now - timestamps[-1]) / len(timestamps)
+        return int(min(max(upload_interval * self._refresh_interval_factor,
+                           self._min_refresh_interval),
+                       self._max_refresh_interval))
+
+    def get_refresh_interval(self, details):
+        """
+        :param dict details: stored details of a feed
+        :return: age in seconds after which the feed is due to be refreshed
+        """
+        return details.get('refresh_interval') or self._min_refresh_interval
+
+    def update_feeds(self, modified=None, not_modified=None):
+        """
+        Stores the results of conditional requests for channel feeds, along
+        with the interval until each feed is next due to be refreshed
+        :param dict modified: details of the feeds that were downloaded, keyed
+                              by channel id, as for set_items()
+        :param dict not_modified: stored details of the feeds that have not
+                                  been modified since last downloaded, keyed
+                                  by channel id
+        """
+        feeds, videos = self._split_videos(modified or {})
+        self._count(feeds_modified=len(feeds))
+        if not_modified:
+            self._count(feeds_not_modified=len(not_modified))
+            feeds.update(
+                (channel_id, details.copy())
+                for channel_id, details in not_modified.items()
+            )
+        if not feeds:
+            return
+
+        now = since_epoch()
+        with self as (db, cursor), db:
+            if videos:
+                self._execute(cursor, 'BEGIN')
+                self._set_videos(cursor, videos, modified)
+                self._execute(cursor, 'COMMIT')
+            for channel_id, details in feeds.items():
+                details['refresh_interval'] = self._refresh_interval(
+                    cursor, channel_id, now
+                )
+        self._set_many(feeds)
+
+    def get_channels(self, seconds=None):
+        """
+        :return: list of ids of the channels of the last listing of the
+                 combined feed, if listed within the last number of seconds
+        """
+        return self._get(self._channels_key, seconds=seconds) or []
+
+    def set_channels(self, channel_ids):
+        self._set(self._channels_key, list(channel_ids))
+
+    def get_stale_channels(self,
+                           lead_time=0,
+                           listed_seconds=Storage.ONE_WEEK):
+        """
+        :param int lead_time: seconds before a feed is due to be refreshed, see
+                              get_refresh_interval(), for it to be stale
+        :param int listed_seconds: max age of the last listing of the combined
+                                   feed, for its channels to be considered
+        :return: list of ids of channels of the last listing that have not
+                 been downloaded, or are stale, most overdue first
+        """
+        channel_ids = self.get_channels(seconds=listed_seconds)
+        if not channel_ids:
+            return []
+        feeds = self.get_items(channel_ids)
+        stale = []
+        for channel_id in channel_ids:
+            feed = feeds.get(channel_id)
+            if not feed:
+                stale.append((float('inf'), channel_id))
+            # stored by a previous version, to be re-indexed when next listed
+            elif 'cached_items' in feed['value']:
+                continue
+            else:
+                overdue = (feed['age'] + lead_time
+                           - self.get_refresh_interval(feed['value']))
+                if overdue > 0:
+                    stale.append((overdue, channel_id))
+        stale.sort(reverse=True)
+        return [channel_id for _, channel_id in stale]
+
+    def _iter_channel_feed(self, cursor, channel_id, position):
+        """
+        Generator of (video id, timestamp) tuples of the videos of a channel,
+        newest first, starting from position. Must be consumed while holding
+        the lock.
+        """
+        query = self._sql['feed_get_channel']
+        chunk_size = self._feed_chunk_size
+        while True:
+            result = self._execute(cursor,
+                                   query,
+                                   (channel_id, chunk_size, position))
+            # the cursor is shared with the other channels being merged
+            rows = list(result)
+            for row in rows:
+                yield row
+            if len(rows) < chunk_size:
+                break
+            position += chunk_size
+
+    @staticmethod
+    def _encode_cursor(channel_ids, positions):
+        checksum = crc32(','.join(channel_ids).encode('utf-8')) & 0xFFFFFFFF
+        return '{0:x}.{1}'.format(
+            checksum,
+            ','.join([str(position) if position else ''
+                      for position in positions]),
+        )
+
+    @staticmethod
+    def _decode_cursor(cursor, channel_ids):
+        """
+        :return: list of position in each channel feed, or None if the cursor
+                 is invalid or was created for a different set of channels
+        """
+        if not cursor:
+            return None
+        try:
+            checksum, positions = cursor.split('.', 1)
+            if (int(checksum, 16) != crc32(','.join(channel_ids)
+                                           .encode('utf-8')) & 0xFFFFFFFF):
+                return None
+            positions = [int(position) if position else 0
+                         for position in positions.split(',')]
+        except ValueError:
+            return None
+        if len(positions) != len(channel_ids):
+            return None
+        return positions
+
+    def get_feed_page(self,
+                      channel_ids,
+                      limit=50,
+                      offset=0,
+                      page_cursor=None):
+        """
+        Reads a page of the merged feed of the given channels, newest first.
+        The videos of each channel are read in order from the index, and are
+        merged using a heap that stops as soon as the page is full. The
+        position reached in each channel is returned as a cursor, from which
+        the merge of the next page is resumed rather than restarted.
+        :param channel_ids: ids of the channels to include
+        :param int limit: max number of videos to read
+        :param int offset: number of videos to skip, only used if there is no
+                           valid cursor for the channels
+        :param str|None page_cursor: cursor returned for the previous page
+        :return: tuple of list of (video id, channel id, timestamp) tuples, and
+                 cursor for the next page, None if there are no further videos
+        """
+        channel_ids = sorted(set(channel_ids))
+        if not channel_ids:
+            return [], None
+
+        positions = self._decode_cursor(page_cursor, channel_ids)
+        if positions is None:
+            positions = [0] * len(channel_ids)
+        else:
+            offset = 0
+        end = offset + limit
+
+        rows = []
+        with self as (db, cursor), db:
+            feeds = [
+                self._iter_channel_feed(cursor, channel_id, position)
+                for channel_id, position in zip(channel_ids, positions)
+            ]
+            heap = []
+            for idx, feed in enumerate(feeds):
+                for video_id, timestamp in feed:
+                    heap.append((-timestamp, video_id, idx))
+                    break
+            heapify(heap)
+
+            # Videos are unique in the index, so each one popped is a new one
+            num_items = 0
+            while heap and num_items < end:
+                timestamp, video_id, idx = heap[0]
+                if num_items >= offset:
+                    rows.append((video_id, channel_ids[idx], -timestamp))
+                num_items += 1
+                positions[idx] += 1
+                for video_id, timestamp in feeds[idx]:
+                    heapreplace(heap, (-timestamp, video_id, idx))
+                    break
+                else:
+                    heappop(heap)
+
+        if heap:
+            return rows, self._encode_cursor(channel_ids, positions)
+        return rows, None
 
     def _optimize_item_count(self, limit=-1, defer=False):
         return False
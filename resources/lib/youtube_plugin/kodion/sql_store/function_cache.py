@@ -13,8 +13,11 @@ from __future__ import absolute_import, division, unicode_literals
 from functools import partial
 from hashlib import md5
 from itertools import chain
+from threading import Lock, Thread, current_thread
 
 from .storage import Storage
+from ..logger import Logger
+from ..utils.single_flight import SingleFlight
 
 
 class FunctionCache(Storage):
@@ -22,6 +25,10 @@ class FunctionCache(Storage):
     _table_updated = False
     _sql = {}
 
+    _compress_threshold = 1024
+    _max_age = Storage.ONE_MONTH
+    _memory_cache_size = 1 * 1024 * 1024
+
     _BUILTIN = str.__module__
     SCOPE_NONE = 0
     SCOPE_BUILTINS = 1
@@ -32,6 +39,11 @@ class FunctionCache(Storage):
         super(FunctionCache, self).__init__(filepath,
                                             max_file_size_kb=max_file_size_kb)
         self._enabled = True
+        # Ids of stale results currently being refreshed in the background
+        self._revalidating = set()
+        self._revalidating_lock = Lock()
+        # Concurrent calls for the same cache id are made only once
+        self._single_flight = SingleFlight('function_cache')
 
     def enabled(self):
         """
@@ -108,6 +120,10 @@ class FunctionCache(Storage):
         :keyword _refresh: (bool) updates cache with new result, default False
         :keyword _retry_value: (Any) re-evaluate func if cached value is equal
                                _retry_value, default None
+        :keyword _stale_ok: (int|bool) return a cached result up to this many
+                            seconds older than seconds immediately, True for
+                            any age, and update it in the background,
+                            default False
         :return:
         """
         scope = kwargs.pop('_scope', self.SCOPE_ALL)
@@ -115,6 +131,7 @@ class FunctionCache(Storage):
         oneshot = kwargs.pop('_oneshot', False)
         refresh = kwargs.pop('_refresh', False)
         retry_value = kwargs.pop('_retry_value', None)
+        stale_ok = kwargs.pop('_stale_ok', False)
         partial_func = partial(func, *args, **kwargs)
 
         # if caching is disabled call the function
@@ -122,16 +139,62 @@ class FunctionCache(Storage):
             return partial_func()
 
         cache_id = self._create_id_from_func(partial_func, scope)
-        data = retry_value if refresh else self._get(cache_id, seconds=seconds)
+        if refresh:
+            data = retry_value
+        elif stale_ok and seconds:
+            cached = self._get(
+                cache_id,
+                seconds=(None if stale_ok is True else seconds + stale_ok),
+                as_dict=True,
+            )
+            data = cached['value'] if cached else retry_value
+            if data != retry_value and cached['age'] > seconds:
+                self._revalidate(cache_id, partial_func, ignore_value)
+                return data
+        else:
+            data = self._get(cache_id, seconds=seconds)
+        shared = False
         if data == retry_value:
-            data = partial_func()
+            data, shared = self._single_flight.do(cache_id, partial_func)
         if data != ignore_value:
-            self._set(cache_id, data)
+            # Result is stored by the first caller if shared
+            if not shared:
+                self._set(cache_id, data)
         elif oneshot:
             self._remove(cache_id)
 
         return data
 
+    def _revalidate(self, cache_id, partial_func, ignore_value):
+        """
+        Updates a stale cached result on a worker thread, unless it is already
+        being updated
+        """
+        with self._revalidating_lock:
+            if cache_id in self._revalidating:
+                return
+            self._revalidating.add(cache_id)
+        thread = Thread(target=self._revalidate_worker,
+                        args=(cache_id, partial_func, ignore_value))
+        thread.daemon = True
+        thread.start()
+
+    def _revalidate_worker(self, cache_id, partial_func, ignore_value):
+        try:
+            data, shared = self._single_flight.do(cache_id, partial_func)
+            if not shared and data != ignore_value:
+                self._set(cache_id, data)
+        except Exception as exc:
+            Logger.log_error('FunctionCache._revalidate - Error'
+                             '\n\tException: {exc!r}'
+                             '\n\tFunction:  {func!r}'
+                             .format(exc=exc, func=partial_func.func))
+        finally:
+            with self._revalidating_lock:
+                self._revalidating.discard(cache_id)
+            # Connections are pooled per thread, release this one
+            self._close((self._filepath, current_thread().ident))
+
     def _optimize_item_count(self, limit=-1, defer=False):
         # override method Storage._optimize_item_count
         # for function cache do not optimize by item count, use database size.
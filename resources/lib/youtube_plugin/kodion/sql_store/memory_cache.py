@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class MemoryCache(object):
+    """
+    Bounded in-process LRU of Storage rows, sized by the bytes of the encoded
+    values. Rows are kept encoded, so each hit is decoded into a new object
+    that the caller is free to modify.
+    """
+    # Approximate per entry overhead of the row tuple and dict slot
+    _ENTRY_OVERHEAD = 128
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._size = 0
+        self._rows = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_size(self, row):
+        return len(row[0]) + row[3] + self._ENTRY_OVERHEAD
+
+    def get(self, key):
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                self.misses += 1
+                return None
+            self._rows[key] = row
+            self.hits += 1
+        return row
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        with self._lock:
+            rows = self._rows
+            for key in keys:
+                row = rows.pop(key, None)
+                if row is None:
+                    missing.append(key)
+                    continue
+                rows[key] = row
+                found[key] = row
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def set_many(self, rows):
+        with self._lock:
+            cached_rows = self._rows
+            size = self._size
+            for row in rows:
+                key = row[0]
+                old_row = cached_rows.pop(key, None)
+                if old_row is not None:
+                    size -= self._entry_size(old_row)
+                entry_size = self._entry_size(row)
+                if entry_size > self._max_size:
+                    continue
+                cached_rows[key] = row
+                size += entry_size
+            while size > self._max_size and cached_rows:
+                _, old_row = cached_rows.popitem(last=False)
+                size -= self._entry_size(old_row)
+            self._size = size
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                row = self._rows.pop(key, None)
+                if row is not None:
+                    self._size -= self._entry_size(row)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'items': len(self._rows),
+                'size': self._size,
+                'max_size': self._max_size,
+            }
@@ -10,13 +10,17 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import json
 import os
 import pickle
 import sqlite3
 import time
-from threading import Lock
+import zlib
+from threading import Lock, current_thread, enumerate as threading_enumerate
 from traceback import format_stack
 
+from .memory_cache import MemoryCache
+from ..compatibility import perf_counter
 from ..logger import Logger
 from ..utils.datetime_parser import fromtimestamp, since_epoch
 from ..utils.methods import make_dirs
@@ -33,6 +37,48 @@ class Storage(object):
     _table_name = 'storage_v2'
     _table_updated = False
 
+    # Shared pool of open connections, keyed by (filepath, thread id)
+    _connections = {}
+    _connections_lock = Lock()
+    _optimize_interval = ONE_HOUR
+    # Number of rows removed per transaction when evicting by size
+    _eviction_slice_size = 500
+    # Max number of slices evicted by a write that exceeds the size limit.
+    # Any remainder is evicted by later writes or by maintenance().
+    _eviction_write_slices = 1
+
+    # Serialisation used for new values, one of CODEC_PICKLE or CODEC_JSON.
+    # Values that cannot be represented as JSON are stored pickled.
+    CODEC_PICKLE = 'pickle'
+    CODEC_JSON = 'json'
+    _codec = CODEC_PICKLE
+    # Serialised values larger than this many bytes are compressed with zlib,
+    # -1 to disable compression
+    _compress_threshold = -1
+    _compress_level = 1
+
+    # Leading byte of a stored value, identifying how it was encoded. Plain
+    # pickles always start with the PROTO opcode, so existing rows and rows
+    # written by previous versions can be read without a marker.
+    _MARKER_PICKLE = b'\x80'
+    _MARKER_JSON = b'J'
+    _MARKER_ZLIB = b'Z'
+
+    # Max size in bytes of the in-process LRU of recently used rows, 0 to
+    # disable. Writes by other processes are detected using the user_version
+    # of the database as a generation counter.
+    _memory_cache_size = 0
+
+    # Rows older than this many seconds are removed by maintenance(), -1 to
+    # keep rows until evicted by count or size
+    _max_age = -1
+    # Max number of free pages returned to the filesystem per maintenance step
+    _vacuum_slice_size = 256
+
+    # Max number of ids bound to a single query. Older SQLite versions are
+    # limited to 999 host parameters per statement.
+    _max_variables = 999
+
     _sql = {
         'clear': (
             'DELETE'
@@ -47,11 +93,20 @@ class Storage(object):
             '  size INTEGER'
             ' );'
         ),
+        'create_index': (
+            'CREATE INDEX'
+            ' IF NOT EXISTS idx_{table}_timestamp'
+            ' ON {table} (timestamp, size);'
+        ),
+        # Tables named {table}_* are auxiliary tables of the current table
+        # and sqlite_* tables are internal, neither are considered old
         'drop_old_table': (
             'DELETE'
             ' FROM sqlite_master'
             ' WHERE type = "table"'
-            ' and name IS NOT "{table}";'
+            ' and name IS NOT "{table}"'
+            ' and name NOT LIKE "{table}_%"'
+            ' and name NOT LIKE "sqlite_%";'
         ),
         'get': (
             'SELECT *'
@@ -89,12 +144,24 @@ class Storage(object):
             ' ORDER BY {order_col} DESC'
             ' LIMIT {{0}};'
         ),
+        'get_oldest_sizes': (
+            'SELECT rowid, size'
+            ' FROM {table}'
+            ' ORDER BY timestamp'
+            ' LIMIT {{0}};'
+        ),
+        'get_total_size': (
+            'SELECT SUM(size)'
+            ' FROM {table};'
+        ),
         'has_old_table': (
             'SELECT EXISTS ('
             ' SELECT 1'
             ' FROM sqlite_master'
             ' WHERE type = "table"'
             ' and name IS NOT "{table}"'
+            ' and name NOT LIKE "{table}_%"'
+            ' and name NOT LIKE "sqlite_%"'
             ');'
         ),
         'is_empty': (
@@ -114,17 +181,14 @@ class Storage(object):
             '  OFFSET {{1}}'
             ' );'
         ),
-        'prune_by_size': (
+        'prune_expired': (
             'DELETE'
             ' FROM {table}'
             ' WHERE rowid IN ('
             '  SELECT rowid'
             '  FROM {table}'
-            '  WHERE ('
-            '   SELECT SUM(size)'
-            '   FROM {table} AS _'
-            '   WHERE timestamp<={table}.timestamp'
-            '  ) <= {{0}}'
+            '  WHERE timestamp < ?'
+            '  LIMIT {{0}}'
             ' );'
         ),
         'remove': (
@@ -137,6 +201,11 @@ class Storage(object):
             ' FROM {table}'
             ' WHERE key in ({{0}});'
         ),
+        'remove_by_rowid': (
+            'DELETE'
+            ' FROM {table}'
+            ' WHERE rowid in ({{0}});'
+        ),
         'set': (
             'REPLACE'
             ' INTO {table}'
@@ -164,11 +233,30 @@ class Storage(object):
                  migrate=False):
         self.uuid = filepath[1]
         self._filepath = os.path.join(*filepath)
-        self._db = None
-        self._cursor = None
+        self._connection = None
         self._lock = Lock()
         self._max_item_count = -1 if migrate else max_item_count
         self._max_file_size_kb = -1 if migrate else max_file_size_kb
+        # Running total of stored value sizes in bytes, None if unknown
+        self._stored_size = None
+        if self._memory_cache_size > 0 and not migrate:
+            self._memory_cache = MemoryCache(self._memory_cache_size)
+        else:
+            self._memory_cache = None
+        self._generation = None
+        # Counters of cache effectiveness, see get_stats(). Updated with
+        # _count(), under their own lock, as stores are shared by threads.
+        self._stats_lock = Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'bytes_read': 0,
+            'bytes_written': 0,
+            'decode_time': 0.0,
+            'evictions': 0,
+            'expired_removed': 0,
+        }
 
         if migrate:
             self._base = self
@@ -208,23 +296,49 @@ class Storage(object):
 
     def __enter__(self):
         self._lock.acquire()
-        if not self._db or not self._cursor:
-            self._open()
-        return self._db, self._cursor
+        connection = self._get_connection()
+        if not connection:
+            return None, None
+        self._connection = connection
+        return connection[0], connection[1]
 
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
-        self._close()
-        self._lock.release()
+        connection = self._connection
+        self._connection = None
+        try:
+            if connection and connection[2] <= time.time():
+                self._execute(connection[1], 'PRAGMA optimize')
+                connection[2] = time.time() + self._optimize_interval
+        finally:
+            self._lock.release()
+
+    def _get_connection(self):
+        key = (self._filepath, current_thread().ident)
+        connection = self._connections.get(key)
+        if connection:
+            # Re-open if the database was deleted from under the connection
+            if os.path.exists(self._filepath):
+                return connection
+            self._close(key, optimize=False)
+        return self._open(key)
 
-    def _open(self):
+    def _open(self, key):
         statements = []
-        if not os.path.exists(self._filepath):
+        new_database = not os.path.exists(self._filepath)
+        if new_database:
             make_dirs(os.path.dirname(self._filepath))
-            statements.append(
-                self._sql['create_table']
-            )
+            statements.extend((
+                self._sql['create_table'],
+                self._sql['create_index'],
+            ))
             self._base._table_updated = True
 
+        # Close any connections left behind by threads that have since ended
+        thread_ids = {thread.ident for thread in threading_enumerate()}
+        for stale_key in tuple(self._connections):
+            if stale_key[1] not in thread_ids:
+                self._close(stale_key)
+
         for _ in range(3):
             try:
                 db = sqlite3.connect(self._filepath,
@@ -242,26 +356,33 @@ class Storage(object):
                     time.sleep(0.1)
                 else:
                     Logger.log_error(msg)
-                    return False
+                    return None
 
         else:
-            return False
+            return None
 
         cursor = db.cursor()
         cursor.arraysize = 100
 
+        # Connections are long-lived and shared between the plugin and service
+        # processes, so locks must not be held between transactions
         sql_script = [
             'PRAGMA busy_timeout = 1000;',
             'PRAGMA read_uncommitted = TRUE;',
             'PRAGMA secure_delete = FALSE;',
             'PRAGMA synchronous = OFF;',
-            'PRAGMA locking_mode = EXCLUSIVE;'
+            'PRAGMA locking_mode = NORMAL;',
             'PRAGMA temp_store = MEMORY;',
             'PRAGMA mmap_size = 4096000;',
             'PRAGMA page_size = 4096;',
             'PRAGMA cache_size = 1000;',
             'PRAGMA journal_mode = WAL;',
         ]
+        # Only takes effect before any table is created. Free pages are then
+        # returned to the filesystem by maintenance() rather than by a full
+        # VACUUM whenever rows are removed.
+        if new_database:
+            sql_script.insert(0, 'PRAGMA auto_vacuum = INCREMENTAL;')
 
         if not self._table_updated:
             for result in self._execute(cursor, self._sql['has_old_table']):
@@ -272,6 +393,7 @@ class Storage(object):
                         'PRAGMA writable_schema = 0;',
                     ))
                 break
+            sql_script.append(self._sql['create_index'])
 
         if statements:
             transaction_begin = len(sql_script) + 1
@@ -280,19 +402,35 @@ class Storage(object):
         self._execute(cursor, '\n'.join(sql_script), script=True)
 
         self._base._table_updated = True
-        self._db = db
-        self._cursor = cursor
-
-    def _close(self):
-        if self._cursor:
-            self._execute(self._cursor, 'PRAGMA optimize')
-            self._cursor.close()
-            self._cursor = None
-        if self._db:
-            # Not needed if using self._db as a context manager
-            # self._db.commit()
-            self._db.close()
-            self._db = None
+        # Other processes may have written to the database since last used
+        self._stored_size = None
+        connection = [db, cursor, time.time() + self._optimize_interval]
+        with self._connections_lock:
+            self._connections[key] = connection
+        return connection
+
+    @classmethod
+    def _close(cls, key, optimize=True):
+        with cls._connections_lock:
+            connection = cls._connections.pop(key, None)
+        if not connection:
+            return
+        db, cursor, _ = connection
+        if optimize:
+            cls._execute(cursor, 'PRAGMA optimize')
+        cursor.close()
+        # Not needed if using db as a context manager
+        # db.commit()
+        db.close()
+
+    def close(self):
+        """
+        Closes all pooled connections to this database, in all threads
+        """
+        with self._lock:
+            for key in tuple(self._connections):
+                if key[0] == self._filepath:
+                    self._close(key)
 
     @staticmethod
     def _execute(cursor, query, values=None, many=False, script=False):
@@ -324,26 +462,258 @@ class Storage(object):
                     return []
         return []
 
-    def _optimize_file_size(self, defer=False):
+    def _sync_generation(self, cursor, bump=False):
+        """
+        Clears the memory cache if the database has been written to by anyone
+        else since the generation was last seen. If bump is True, must be
+        called after writing to the database within the same transaction.
+        """
+        generation = None
+        for item in self._execute(cursor, 'PRAGMA user_version'):
+            generation = item[0]
+            break
+        if generation is None or generation != self._generation:
+            self._memory_cache.clear()
+        if bump and generation is not None:
+            generation = (generation + 1) & 0x7FFFFFFF
+            self._execute(cursor,
+                          'PRAGMA user_version = {0}'.format(generation))
+        self._generation = generation
+
+    @classmethod
+    def _uncompressed(cls, rows):
+        """
+        Rows are kept decompressed in the memory cache, so that a hit only
+        costs deserialising the value.
+        """
+        marker = cls._MARKER_ZLIB
+        for row in rows:
+            value = row[2]
+            if value[:1] == marker:
+                value = zlib.decompress(value[1:])
+                row = (row[0], row[1], value, len(value))
+            yield row
+
+    @classmethod
+    def _get_pragma(cls, cursor, pragma):
+        for item in cls._execute(cursor, 'PRAGMA {0}'.format(pragma)):
+            return item[0]
+        return None
+
+    def maintenance(self):
+        """
+        Generator that performs database maintenance one short transaction at
+        a time, so that it can be spread over idle periods by the caller:
+        - rows older than _max_age are removed, in slices of
+          _eviction_slice_size rows
+        - the oldest rows are removed, in slices of _eviction_slice_size
+          rows, until the size of the database is within its limit
+        - free pages are returned to the filesystem, in slices of
+          _vacuum_slice_size pages, if incremental auto vacuum is enabled
+        - query planner statistics are updated
+        The lock is not held while suspended.
+        :return: generator yielding the number of rows removed by each step
+        """
+        if self._max_age > 0:
+            slice_size = self._eviction_slice_size
+            query = self._sql['prune_expired'].format(slice_size)
+            cut_off = since_epoch() - self._max_age
+            removed = slice_size
+            while removed >= slice_size:
+                with self as (db, cursor), db:
+                    self._execute(cursor, 'BEGIN')
+                    result = self._execute(cursor, query, (cut_off,))
+                    removed = result.rowcount if result else 0
+                    if removed:
+                        self._count(expired_removed=removed)
+                        if self._memory_cache:
+                            self._sync_generation(cursor, bump=True)
+                            self._memory_cache.clear()
+                        self._stored_size = None
+                yield removed
+
+        prune_size = self._optimize_file_size(defer=True)
+        while prune_size > 0:
+            removed, evicted = self._evict_oldest(prune_size, max_slices=1)
+            if not removed:
+                break
+            prune_size -= evicted
+            yield removed
+
+        with self as (db, cursor), db:
+            auto_vacuum = self._get_pragma(cursor, 'auto_vacuum')
+        # 2 is INCREMENTAL
+        if auto_vacuum == 2:
+            query = 'PRAGMA incremental_vacuum({0})'.format(
+                self._vacuum_slice_size
+            )
+            free_pages = self._vacuum_slice_size
+            while free_pages > 0:
+                with self as (db, cursor), db:
+                    free_pages = self._get_pragma(cursor, 'freelist_count')
+                    if free_pages:
+                        # Pages are only freed as the pragma is stepped
+                        for _ in self._execute(cursor, query):
+                            pass
+                        free_pages -= self._vacuum_slice_size
+                yield 0
+
+        with self as (db, cursor), db:
+            has_stats = self._execute(
+                cursor,
+                'SELECT EXISTS ('
+                ' SELECT 1'
+                ' FROM sqlite_master'
+                ' WHERE name = "sqlite_stat1"'
+                ');'
+            )
+            if any(item[0] for item in has_stats):
+                self._execute(cursor, 'PRAGMA optimize')
+            else:
+                self._execute(cursor, 'ANALYZE')
+            self._execute(cursor, 'PRAGMA wal_checkpoint(TRUNCATE)')
+            connection = self._connection
+            if connection:
+                connection[2] = time.time() + self._optimize_interval
+        yield 0
+
+    def get_memory_cache_stats(self):
+        if self._memory_cache:
+            return self._memory_cache.stats()
+        return None
+
+    def get_stats(self):
+        """
+        Counters since this instance was created:
+        - hits: items read that were within the requested age
+        - misses: requested items that were not found
+        - expired: items found that were older than the requested age
+        - bytes_read, bytes_written: size of the stored values
+        - decode_time: seconds spent deserialising values
+        - evictions: items removed to stay within the size or count limits
+        - expired_removed: items removed by maintenance() for being too old
+        - memory_cache: hit/miss counters and size of the memory cache
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['memory_cache'] = self.get_memory_cache_stats()
+        return stats
+
+    def _count(self, **counts):
+        """
+        Adds to the counters returned by get_stats()
+        """
+        with self._stats_lock:
+            stats = self._stats
+            for name, value in counts.items():
+                stats[name] += value
+
+    @staticmethod
+    def merge_stats(*stats_dicts):
+        """
+        Sums the counters of stats dicts, as returned by get_stats(), that may
+        be nested in dicts of stores
+        """
+        merged = {}
+        for stats in stats_dicts:
+            if not stats:
+                continue
+            for name, value in stats.items():
+                if isinstance(value, dict):
+                    merged[name] = Storage.merge_stats(merged.get(name), value)
+                elif isinstance(value, (int, float)):
+                    if name == 'max_size':
+                        merged[name] = max(merged.get(name, 0), value)
+                    else:
+                        merged[name] = merged.get(name, 0) + value
+        return merged
+
+    def _load(self, item, process=None):
+        """
+        Decodes the stored value of a row, recording the time taken and size
+        """
+        start = perf_counter()
+        value = self._decode(item[2], process, item)
+        self._count(decode_time=perf_counter() - start,
+                    bytes_read=len(item[2]))
+        return value
+
+    def _get_stored_size(self):
+        with self as (db, cursor), db:
+            result = self._execute(cursor, self._sql['get_total_size'])
+            for item in result:
+                stored_size = item[0] or 0
+                break
+            else:
+                stored_size = 0
+            self._stored_size = stored_size
+        return stored_size
+
+    def _optimize_file_size(self, defer=False, max_slices=-1):
+        """
+        Evicts the oldest rows if the stored size exceeds the size limit
+        :param bool defer: True to only return the number of bytes to evict
+        :param int max_slices: max number of slices to evict, -1 for all
+        :return: number of bytes to evict if deferred, otherwise True if any
+                 rows were evicted
+        """
         # do nothing - optimize only if max size limit has been set
         if self._max_file_size_kb <= 0:
             return False
 
-        try:
-            file_size_kb = (os.path.getsize(self._filepath) // 1024)
-            if file_size_kb <= self._max_file_size_kb:
-                return False
-        except OSError:
+        max_size = 1024 * self._max_file_size_kb
+        stored_size = self._stored_size
+        # running total is an estimate, confirm before evicting anything
+        if stored_size is None or stored_size > max_size:
+            stored_size = self._get_stored_size()
+        if stored_size <= max_size:
             return False
 
-        prune_size = 1024 * int(file_size_kb - self._max_file_size_kb / 2)
-        query = self._sql['prune_by_size'].format(prune_size)
+        prune_size = stored_size - max_size // 2
         if defer:
-            return query
-        with self as (db, cursor), db:
-            self._execute(cursor, query)
-            self._execute(cursor, 'VACUUM')
-        return True
+            return prune_size
+        return self._evict_oldest(prune_size, max_slices)[0] > 0
+
+    def _evict_oldest(self, prune_size, max_slices=-1):
+        """
+        Removes the oldest rows until at least prune_size bytes have been
+        evicted. Rows are walked once in (timestamp, size) index order, in
+        slices of _eviction_slice_size rows, each in its own transaction.
+        :param int prune_size: number of bytes to evict
+        :param int max_slices: max number of slices to process, -1 for all
+        :return: tuple of the number of rows and bytes evicted
+        """
+        removed = evicted = 0
+        query = self._sql['get_oldest_sizes'].format(self._eviction_slice_size)
+        while evicted < prune_size and max_slices:
+            max_slices -= 1
+            with self as (db, cursor), db:
+                self._execute(cursor, 'BEGIN')
+                rowids = []
+                slice_size = 0
+                for rowid, size in self._execute(cursor, query):
+                    rowids.append(rowid)
+                    slice_size += size or 0
+                    if evicted + slice_size >= prune_size:
+                        break
+                if not rowids:
+                    break
+                self._execute(
+                    cursor,
+                    self._sql['remove_by_rowid'].format(
+                        '?,' * (len(rowids) - 1) + '?'
+                    ),
+                    rowids,
+                )
+                if self._memory_cache:
+                    self._sync_generation(cursor, bump=True)
+                    self._memory_cache.clear()
+                removed += len(rowids)
+                evicted += slice_size
+                self._count(evictions=len(rowids))
+                if self._stored_size is not None:
+                    self._stored_size = max(0, self._stored_size - slice_size)
+        return removed, evicted
 
     def _optimize_item_count(self, limit=-1, defer=False):
         # do nothing - optimize only if max item limit has been set
@@ -362,18 +732,30 @@ class Storage(object):
         if defer:
             return query
         with self as (db, cursor), db:
-            self._execute(cursor, query)
-            self._execute(cursor, 'VACUUM')
+            result = self._execute(cursor, query)
+            if result:
+                self._count(evictions=max(0, result.rowcount))
         return True
 
     def _set(self, item_id, item, timestamp=None):
         values = self._encode(item_id, item, timestamp)
         optimize_query = self._optimize_item_count(1, defer=True)
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
-            if optimize_query:
+            if optimize_query or memory_cache:
                 self._execute(cursor, 'BEGIN')
+            if optimize_query:
                 self._execute(cursor, optimize_query)
             self._execute(cursor, self._sql['set'], values=values)
+            if memory_cache:
+                self._sync_generation(cursor, bump=True)
+                if optimize_query:
+                    memory_cache.clear()
+                memory_cache.set_many(self._uncompressed((values,)))
+            if self._stored_size is not None:
+                self._stored_size += values[-1]
+            self._count(bytes_written=values[-1])
+        self._optimize_file_size(max_slices=self._eviction_write_slices)
 
     def _set_many(self, items, flatten=False):
         now = since_epoch()
@@ -386,31 +768,60 @@ class Storage(object):
             query = self._sql['set_flat'].format(
                 '(?,?,?,?),' * (num_items - 1) + '(?,?,?,?)'
             )
+            size = sum(values[3::4])
         else:
             values = [self._encode(*item, timestamp=now)
                       for item in items.items()]
             query = self._sql['set']
+            size = sum(value[3] for value in values)
 
         optimize_query = self._optimize_item_count(num_items, defer=True)
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
             self._execute(cursor, 'BEGIN')
             if optimize_query:
                 self._execute(cursor, optimize_query)
             self._execute(cursor, query, many=(not flatten), values=values)
-        self._optimize_file_size()
+            if memory_cache:
+                self._sync_generation(cursor, bump=True)
+                if optimize_query:
+                    memory_cache.clear()
+                memory_cache.set_many(self._uncompressed(
+                    zip(*[iter(values)] * 4) if flatten else values
+                ))
+            if self._stored_size is not None:
+                self._stored_size += size
+            self._count(bytes_written=size)
+        self._optimize_file_size(max_slices=self._eviction_write_slices)
 
     def _update(self, item_id, item, timestamp=None):
         values = self._encode(item_id, item, timestamp, for_update=True)
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
+            if memory_cache:
+                self._execute(cursor, 'BEGIN')
             self._execute(cursor, self._sql['update'], values=values)
+            if memory_cache:
+                self._sync_generation(cursor, bump=True)
+                memory_cache.discard((values[-1],))
+            self._stored_size = None
+            self._count(bytes_written=values[-2])
 
     def clear(self, defer=False):
         query = self._sql['clear']
         if defer:
             return query
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
+            if memory_cache:
+                self._execute(cursor, 'BEGIN')
             self._execute(cursor, query)
+            if memory_cache:
+                self._sync_generation(cursor, bump=True)
+                self._execute(cursor, 'COMMIT')
+                memory_cache.clear()
             self._execute(cursor, 'VACUUM')
+            self._stored_size = 0
         return True
 
     def is_empty(self):
@@ -423,19 +834,46 @@ class Storage(object):
                 is_empty = True
         return is_empty
 
-    @staticmethod
-    def _decode(obj, process=None, item=None):
-        decoded_obj = pickle.loads(obj)
+    @classmethod
+    def _deserialise(cls, data):
+        marker = data[:1]
+        if marker == cls._MARKER_ZLIB:
+            return cls._deserialise(zlib.decompress(data[1:]))
+        if marker == cls._MARKER_JSON:
+            return json.loads(bytes(data[1:]).decode('utf-8'))
+        return pickle.loads(data)
+
+    @classmethod
+    def _serialise(cls, obj):
+        data = None
+        if cls._codec == cls.CODEC_JSON:
+            try:
+                data = cls._MARKER_JSON + json.dumps(
+                    obj, separators=(',', ':')
+                ).encode('utf-8')
+            except (TypeError, ValueError):
+                pass
+        if data is None:
+            data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+        threshold = cls._compress_threshold
+        if 0 <= threshold < len(data):
+            compressed = zlib.compress(data, cls._compress_level)
+            if len(compressed) < len(data):
+                data = cls._MARKER_ZLIB + compressed
+        return data
+
+    @classmethod
+    def _decode(cls, obj, process=None, item=None):
+        decoded_obj = cls._deserialise(obj)
         if process:
             return process(decoded_obj, item)
         return decoded_obj
 
-    @staticmethod
-    def _encode(key, obj, timestamp=None, for_update=False):
+    @classmethod
+    def _encode(cls, key, obj, timestamp=None, for_update=False):
         timestamp = timestamp or since_epoch()
-        blob = sqlite3.Binary(pickle.dumps(
-            obj, protocol=pickle.HIGHEST_PROTOCOL
-        ))
+        blob = sqlite3.Binary(cls._serialise(obj))
         size = getattr(blob, 'nbytes', None)
         if not size:
             size = int(memoryview(blob).itemsize) * len(blob)
@@ -446,25 +884,69 @@ class Storage(object):
         return timestamp, blob, size
 
     def _get(self, item_id, process=None, seconds=None, as_dict=False):
+        key = str(item_id)
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
-            result = self._execute(cursor, self._sql['get'], [str(item_id)])
-            item = result.fetchone() if result else None
+            if memory_cache:
+                self._sync_generation(cursor)
+                item = memory_cache.get(key)
+            else:
+                item = None
             if not item:
-                return None
+                result = self._execute(cursor, self._sql['get'], [key])
+                item = result.fetchone() if result else None
+                if not item:
+                    self._count(misses=1)
+                    return None
+                if memory_cache:
+                    item = next(self._uncompressed((item,)))
+                    memory_cache.set_many((item,))
         cut_off = since_epoch() - seconds if seconds else 0
         if not cut_off or item[1] >= cut_off:
+            self._count(hits=1)
             if as_dict:
                 return {
                     'item_id': item_id,
                     'age': since_epoch() - item[1],
-                    'value': self._decode(item[2], process, item),
+                    'value': self._load(item, process),
                 }
-            return self._decode(item[2], process, item)
+            return self._load(item, process)
+        self._count(expired=1)
         return None
 
+    def _fetch_by_ids(self, cursor, item_ids):
+        """
+        Reads rows from the memory cache where possible, and otherwise from
+        the database in chunks of up to _max_variables ids per query. Must be
+        called while holding the lock.
+        :param cursor: cursor of the current connection
+        :param tuple|list item_ids: keys of the rows to read
+        :return: dict of rows found, keyed by item id
+        """
+        memory_cache = self._memory_cache
+        if memory_cache:
+            self._sync_generation(cursor)
+            rows, item_ids = memory_cache.get_many(item_ids)
+        else:
+            rows = {}
+
+        chunk_size = self._max_variables
+        for idx in range(0, len(item_ids), chunk_size):
+            chunk = item_ids[idx:idx + chunk_size]
+            query = self._sql['get_by_key'].format(
+                '?,' * (len(chunk) - 1) + '?'
+            )
+            result = self._execute(cursor, query, chunk)
+            if memory_cache:
+                result = list(self._uncompressed(result))
+                memory_cache.set_many(result)
+            rows.update((row[0], row) for row in result)
+        return rows
+
     def _get_by_ids(self, item_ids=None, oldest_first=True, limit=-1,
                     wildcard=False, seconds=None, process=None,
                     as_dict=False, values_only=True):
+        memory_cache = None
         if not item_ids:
             if oldest_first:
                 query = self._sql['get_many']
@@ -478,49 +960,83 @@ class Storage(object):
                 query = self._sql['get_by_key_like_desc']
             query = query.format(limit)
         else:
-            num_ids = len(item_ids)
-            query = self._sql['get_by_key'].format('?,' * (num_ids - 1) + '?')
-            item_ids = tuple(item_ids)
+            query = None
+            # remove duplicates while keeping the requested order
+            item_ids = tuple(dict.fromkeys(item_ids))
 
         epoch = since_epoch()
         cut_off = epoch - seconds if seconds else 0
         with self as (db, cursor), db:
-            result = self._execute(cursor, query, item_ids)
+            if query:
+                result = self._execute(cursor, query, item_ids)
+            else:
+                rows = self._fetch_by_ids(cursor, item_ids)
+                result = [rows[item_id]
+                          for item_id in item_ids
+                          if item_id in rows]
+                self._count(misses=len(item_ids) - len(result))
+
+            if cut_off:
+                result = list(result)
+                num_rows = len(result)
+                result = [item for item in result if item[1] >= cut_off]
+                self._count(expired=num_rows - len(result))
+
             if as_dict:
                 if values_only:
                     result = {
-                        item[0]: self._decode(item[2], process, item)
-                        for item in result if not cut_off or item[1] >= cut_off
+                        item[0]: self._load(item, process)
+                        for item in result
                     }
                 else:
                     result = {
                         item[0]: {
                             'age': epoch - item[1],
-                            'value': self._decode(item[2], process, item),
+                            'value': self._load(item, process),
                         }
-                        for item in result if not cut_off or item[1] >= cut_off
+                        for item in result
                     }
             elif values_only:
                 result = [
-                    self._decode(item[2], process, item)
-                    for item in result if not cut_off or item[1] >= cut_off
+                    self._load(item, process)
+                    for item in result
                 ]
             else:
                 result = [
                     (item[0],
                      fromtimestamp(item[1]),
-                     self._decode(item[2], process, item))
-                    for item in result if not cut_off or item[1] >= cut_off
+                     self._load(item, process))
+                    for item in result
                 ]
+            self._count(hits=len(result))
         return result
 
     def _remove(self, item_id):
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
+            if memory_cache:
+                self._execute(cursor, 'BEGIN')
             self._execute(cursor, self._sql['remove'], [item_id])
+            if memory_cache:
+                self._sync_generation(cursor, bump=True)
+                memory_cache.discard((str(item_id),))
+            self._stored_size = None
 
     def _remove_many(self, item_ids):
-        num_ids = len(item_ids)
-        query = self._sql['remove_by_key'].format('?,' * (num_ids - 1) + '?')
+        item_ids = tuple(item_ids)
+        chunk_size = self._max_variables
+        memory_cache = self._memory_cache
         with self as (db, cursor), db:
-            self._execute(cursor, query, tuple(item_ids))
-            self._execute(cursor, 'VACUUM')
+            self._execute(cursor, 'BEGIN')
+            for idx in range(0, len(item_ids), chunk_size):
+                chunk = item_ids[idx:idx + chunk_size]
+                query = self._sql['remove_by_key'].format(
+                    '?,' * (len(chunk) - 1) + '?'
+                )
+                self._execute(cursor, query, chunk)
+            if memory_cache:
+                self._sync_generation(cursor, bump=True)
+            self._execute(cursor, 'COMMIT')
+            if memory_cache:
+                memory_cache.discard(map(str, item_ids))
+            self._stored_size = None
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2023-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from .storage import Storage
+
+
+class StreamCache(Storage):
+    """
+    Streams of played videos and their MPD manifests, kept apart from the
+    DataCache as they are large and only usable until their URLs expire
+    """
+    _table_name = 'storage_v2'
+    _table_updated = False
+    _sql = {}
+
+    _compress_threshold = 1024
+    _max_age = Storage.ONE_DAY
+
+    def __init__(self, filepath, max_file_size_mb=2):
+        max_file_size_kb = max_file_size_mb * 1024
+        super(StreamCache, self).__init__(filepath,
+                                          max_file_size_kb=max_file_size_kb)
+
+    def get_item(self, content_id, seconds=None):
+        result = self._get(content_id, seconds=seconds)
+        return result
+
+    def set_item(self, content_id, item):
+        self._set(content_id, item)
+
+    def del_item(self, content_id):
+        self._remove(content_id)
+
+    def _optimize_item_count(self, limit=-1, defer=False):
+        return False
@@ -34,6 +34,9 @@ class AbstractContextUI(object):
     def on_ok(self, title, text):
         raise NotImplementedError()
 
+    def show_text(self, title, text):
+        raise NotImplementedError()
+
     def on_remove_content(self, name):
         raise NotImplementedError()
 
@@ -60,6 +60,10 @@ class XbmcContextUI(AbstractContextUI):
         dialog = xbmcgui.Dialog()
         return dialog.ok(title, text)
 
+    def show_text(self, title, text):
+        dialog = xbmcgui.Dialog()
+        return dialog.textviewer(title, text)
+
     def on_remove_content(self, name):
         return self.on_yes_no_input(
             self._context.localize('content.remove'),
@@ -30,6 +30,8 @@ from .methods import (
     validate_ip_address,
     wait,
 )
+from .pipeline import Pipeline
+from .single_flight import SingleFlight
 from .system_version import current_system_version
 
 
@@ -45,10 +47,12 @@ __all__ = (
     'loose_version',
     'make_dirs',
     'merge_dicts',
+    'Pipeline',
     'redact_ip',
     'rm_dir',
     'seconds_to_duration',
     'select_stream',
+    'SingleFlight',
     'strip_html_from_text',
     'to_unicode',
     'validate_ip_address',
@@ -11,6 +11,7 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import re
+from calendar import timegm
 from datetime import date, datetime, time as dt_time, timedelta
 from importlib import import_module
 from sys import modules
@@ -35,6 +36,10 @@ __RE_MATCH_DATETIME__ = re.compile(
     r'^(?P<year>[0-9]{4})[-/.]?(?P<month>[0-9]{2})[-/.]?(?P<day>[0-9]{2})'
     r'["T ](?P<hour>[0-9]{2}):?(?P<minute>[0-9]{2}):?(?P<second>[0-9]{2})'
 )
+__RE_MATCH_RFC3339__ = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.\d+)?'
+    r'(?:Z|([+-])(\d{2}):(\d{2}))$'
+)
 __RE_MATCH_PERIOD__ = re.compile(
     r'P((?P<years>\d+)Y)?((?P<months>\d+)M)?((?P<days>\d+)D)?'
     r'(T((?P<hours>\d+)H)?((?P<minutes>\d+)M)?((?P<seconds>\d+)S)?)?'
@@ -311,6 +316,30 @@ def since_epoch(dt_object=None):
     return (dt_object - __INTERNAL_CONSTANTS__['epoch_dt']).total_seconds()
 
 
+def rfc3339_since_epoch(datetime_str):
+    """
+    Fast path for the fixed format RFC 3339 timestamps used by Atom feeds e.g.
+    '2024-05-01T10:00:00+00:00', without creating datetime objects. Other
+    formats are parsed using strptime.
+    :return: seconds since epoch, excluding any fractional seconds
+    """
+    match = __RE_MATCH_RFC3339__.match(datetime_str)
+    if not match:
+        return since_epoch(strptime(datetime_str))
+    (year, month, day,
+     hour, minute, second,
+     sign, offset_hours, offset_minutes) = match.groups()
+    seconds = timegm((int(year), int(month), int(day),
+                      int(hour), int(minute), int(second)))
+    if sign:
+        offset = 3600 * int(offset_hours) + 60 * int(offset_minutes)
+        if sign == '+':
+            seconds -= offset
+        else:
+            seconds += offset
+    return float(seconds)
+
+
 def yt_datetime_offset(**kwargs):
     if timezone:
         _now = now(tz=timezone.utc)
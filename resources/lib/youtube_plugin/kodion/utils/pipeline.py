@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from threading import Event, Lock, Thread
+from traceback import format_exc
+
+from ..compatibility import perf_counter
+from ..logger import Logger
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
+
+
+class _Done(object):
+    """
+    Marker passed down the pipeline once all items have been produced
+    """
+
+
+class Pipeline(object):
+    """
+    Bounded pipeline of worker threads. Items produced by a source iterable
+    are passed through a number of stages, each run by a fixed number of
+    worker threads, and are connected by bounded queues. Workers block when
+    the queue to the next stage is full, so that a slow stage applies
+    backpressure to the stages before it rather than letting items pile up.
+    The results of the last stage are consumed by iterating over run().
+    Exceptions raised by the source or by a stage are logged, and the
+    pipeline is marked as failed, as its output is then incomplete, see
+    is_failed(). Time spent by each stage is recorded, see stats().
+    """
+    _DONE = _Done()
+    # Max time in seconds that workers block on a queue before checking
+    # whether the pipeline has been cancelled
+    _poll_interval = 0.1
+
+    def __init__(self, source, stages, queue_size=None, abort_check=None):
+        """
+        :param iterable source: items to process. Consumed in its own thread,
+                                so it can be a generator that blocks on I/O.
+        :param stages: list of (name, func, num_workers) tuples. func is
+                       called with each item from the previous stage, and
+                       returns an iterable, such as a generator, of any number
+                       of items for the next stage, or None.
+        :param int queue_size: max number of items waiting between stages,
+                               twice the number of workers of the next stage
+                               by default
+        :param callable abort_check: called while iterating over run(), if it
+                                     returns True the pipeline is cancelled
+        """
+        self._source = source
+        self._stages = stages
+        self._queue_size = queue_size
+        self._abort_check = abort_check
+        self._cancelled = Event()
+        self._failed = Event()
+        self._lock = Lock()
+        self._stats = {}
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def is_failed(self):
+        """
+        :return: True if the source or a stage raised an exception, in which
+                 case the items output by the pipeline are incomplete
+        """
+        return self._failed.is_set()
+
+    def _log_error(self, name):
+        self._failed.set()
+        Logger.log_error('Pipeline - Error'
+                         '\n\tStage: {name}'
+                         '\n\tStack trace (most recent call last):'
+                         '\n{stack}'
+                         .format(name=name, stack=format_exc()))
+
+    def stats(self):
+        """
+        :return: dict keyed by stage name, of number of items input and
+                 output by the stage, seconds spent processing items, and
+                 seconds spent blocked waiting for the next stage
+        """
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def _get(self, queue):
+        while not self._cancelled.is_set():
+            try:
+                return queue.get(timeout=self._poll_interval)
+            except Empty:
+                pass
+        return self._DONE
+
+    def _put(self, queue, item):
+        while not self._cancelled.is_set():
+            try:
+                queue.put(item, timeout=self._poll_interval)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _process(self, name, items, output):
+        """
+        Passes the items produced by an iterable to the output queue, timing
+        how long each item takes to produce, and how long it takes to queue
+        :return: tuple of number of items output, seconds processing, seconds
+                 blocked, and whether the pipeline is still running
+        """
+        num_items = 0
+        busy = blocked = 0
+        iterator = iter(items or ())
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                busy += perf_counter() - start
+                break
+            except Exception:
+                busy += perf_counter() - start
+                self._log_error(name)
+                break
+            queued = perf_counter()
+            busy += queued - start
+            if not self._put(output, item):
+                return num_items, busy, blocked, False
+            blocked += perf_counter() - queued
+            num_items += 1
+        return num_items, busy, blocked, True
+
+    def _record(self, name, items_in, items_out, busy, blocked):
+        with self._lock:
+            stats = self._stats[name]
+            stats['items_in'] += items_in
+            stats['items_out'] += items_out
+            stats['busy'] += busy
+            stats['blocked'] += blocked
+
+    def _run_source(self, name, output):
+        try:
+            items_out, busy, blocked, _ = self._process(name,
+                                                        self._source,
+                                                        output)
+            self._record(name, 0, items_out, busy, blocked)
+        finally:
+            self._put(output, self._DONE)
+
+    def _run_stage(self, name, func, input_queue, output, remaining):
+        while True:
+            item = self._get(input_queue)
+            if item is self._DONE:
+                break
+            start = perf_counter()
+            try:
+                items = func(item)
+            except Exception:
+                self._log_error(name)
+                self._record(name, 1, 0, perf_counter() - start, 0)
+                continue
+            called = perf_counter() - start
+            items_out, busy, blocked, running = self._process(name,
+                                                              items,
+                                                              output)
+            self._record(name, 1, items_out, called + busy, blocked)
+            if not running:
+                break
+
+        # Pass the marker on to the other workers of this stage, and on to
+        # the next stage once the last worker of this stage has finished
+        self._put(input_queue, self._DONE)
+        with self._lock:
+            remaining[0] -= 1
+            last_worker = not remaining[0]
+        if last_worker:
+            self._put(output, self._DONE)
+
+    def run(self, consumer='consumer'):
+        """
+        Starts the pipeline and generates the items output by the last stage.
+        The pipeline is cancelled if the generator is closed before all items
+        have been consumed.
+        :param str consumer: stage name under which to record the time spent
+                             by the caller between items
+        """
+        threads = []
+        stats = self._stats
+        stats.clear()
+        self._failed.clear()
+
+        queue_size = self._queue_size
+        output = Queue(
+            queue_size or 2 * (self._stages[0][2] if self._stages else 1)
+        )
+        threads.append(Thread(target=self._run_source,
+                              args=('source', output)))
+        stats['source'] = {
+            'items_in': 0, 'items_out': 0, 'busy': 0, 'blocked': 0,
+        }
+
+        for idx, (name, func, num_workers) in enumerate(self._stages):
+            input_queue = output
+            if idx + 1 < len(self._stages):
+                next_workers = self._stages[idx + 1][2]
+            else:
+                next_workers = 1
+            output = Queue(queue_size or 2 * next_workers)
+            remaining = [num_workers]
+            stats[name] = {
+                'items_in': 0, 'items_out': 0, 'busy': 0, 'blocked': 0,
+                'workers': num_workers,
+            }
+            threads.extend([
+                Thread(target=self._run_stage,
+                       args=(name, func, input_queue, output, remaining))
+                for _ in range(num_workers)
+            ])
+        stats[consumer] = {
+            'items_in': 0, 'items_out': 0, 'busy': 0, 'blocked': 0,
+        }
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        abort_check = self._abort_check
+        start = perf_counter()
+        completed = False
+        items_in = 0
+        busy = 0
+        try:
+            while True:
+                if abort_check and abort_check():
+                    self.cancel()
+                    break
+                try:
+                    item = output.get(timeout=self._poll_interval)
+                except Empty:
+                    if self._cancelled.is_set():
+                        break
+                    continue
+                if item is self._DONE:
+                    completed = True
+                    break
+                items_in += 1
+                resumed = perf_counter()
+                yield item
+                busy += perf_counter() - resumed
+        finally:
+            self._record(consumer, items_in, 0, busy, 0)
+            # Workers still running are left to stop on their own, after
+            # completing the item currently being processed
+            if completed:
+                for thread in threads:
+                    thread.join()
+            else:
+                self.cancel()
+            with self._lock:
+                stats['total'] = {'time': perf_counter() - start}
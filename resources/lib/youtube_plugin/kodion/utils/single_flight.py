@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from copy import deepcopy
+from threading import Event, Lock
+from weakref import WeakSet
+
+
+class _Call(object):
+    __slots__ = ('event', 'failed', 'results', 'waiters')
+
+    def __init__(self):
+        self.event = Event()
+        self.failed = True
+        self.results = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Registry of in-flight requests, used to collapse concurrent requests for
+    the same keys. The first caller claims a key and makes the request, any
+    other callers for that key wait for it to complete and share its result.
+    Each waiter is given its own copy of the result, so the result is only
+    copied if there are waiters.
+    """
+    # Named instances, for the counters returned by get_all_stats()
+    _instances = WeakSet()
+    _instances_lock = Lock()
+
+    def __init__(self, name=None):
+        self._lock = Lock()
+        self._calls = {}
+        self.name = name
+        self.requests = 0
+        self.collapsed = 0
+        if name:
+            with self._instances_lock:
+                self._instances.add(self)
+
+    def acquire(self, keys):
+        """
+        Claims the keys that are not already in flight. Claimed keys must be
+        released with release(), even if the request fails.
+        :param iterable keys: keys to claim
+        :return: tuple of list of claimed keys, and dict of in-flight calls
+                 for the remaining keys, to pass to wait()
+        """
+        claimed = []
+        in_flight = {}
+        with self._lock:
+            calls = self._calls
+            for key in keys:
+                call = calls.get(key)
+                if call is None:
+                    calls[key] = _Call()
+                    claimed.append(key)
+                elif key not in in_flight:
+                    call.waiters += 1
+                    in_flight[key] = call
+            self.requests += len(claimed)
+            self.collapsed += len(in_flight)
+        return claimed, in_flight
+
+    def release(self, keys, results=None):
+        """
+        Completes the calls for the claimed keys and wakes any waiters. The
+        results are copied for each waiter before returning, so the caller
+        can then modify them.
+        :param iterable keys: keys previously claimed with acquire()
+        :param dict|None results: result for each key, None if the request
+                                  failed
+        """
+        with self._lock:
+            calls = [self._calls.pop(key, None) for key in keys]
+        failed = results is None
+        for key, call in zip(keys, calls):
+            if call is None:
+                continue
+            call.failed = failed
+            if not failed and call.waiters:
+                result = results.get(key)
+                if result is not None:
+                    call.results = [deepcopy(result)
+                                    for _ in range(call.waiters)]
+            call.event.set()
+
+    @staticmethod
+    def wait(in_flight):
+        """
+        Waits for in-flight calls to complete
+        :param dict in_flight: in-flight calls returned by acquire()
+        :return: dict of results of calls that succeeded with a result
+        """
+        results = {}
+        for key, call in in_flight.items():
+            call.event.wait()
+            if not call.failed and call.results:
+                results[key] = call.results.pop()
+        return results
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Calls func, unless a call for key is already in flight, in which case
+        the result of that call is used. If the in-flight call fails, func is
+        called again.
+        :return: tuple of result, and whether it was shared with another caller
+        """
+        claimed, in_flight = self.acquire((key,))
+        if in_flight:
+            call = in_flight[key]
+            call.event.wait()
+            if not call.failed:
+                return call.results.pop() if call.results else None, True
+            return func(*args, **kwargs), False
+
+        results = None
+        try:
+            result = func(*args, **kwargs)
+            results = {key: result}
+        finally:
+            self.release(claimed, results)
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'collapsed': self.collapsed,
+                'in_flight': len(self._calls),
+            }
+
+    @classmethod
+    def get_all_stats(cls):
+        """
+        Sums the counters of all named instances in this process, by name
+        :return: dict of counters, see stats(), keyed by name
+        """
+        with cls._instances_lock:
+            instances = list(cls._instances)
+        stats = {}
+        for instance in instances:
+            totals = stats.setdefault(instance.name, {
+                'requests': 0,
+                'collapsed': 0,
+                'in_flight': 0,
+            })
+            for key, value in instance.stats().items():
+                totals[key] += value
+        return stats
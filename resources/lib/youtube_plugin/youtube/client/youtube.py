@@ -12,22 +12,17 @@ from __future__ import absolute_import, division, unicode_literals
 
 import json
 import threading
-import xml.etree.ElementTree as ET
-from functools import partial
+from hashlib import md5
 from itertools import chain, islice
 from random import randint
-from traceback import format_stack
 
 from .login_client import LoginClient
+from ..helper.feed_parser import ParseError, parse_feed
 from ..helper.stream_info import StreamInfo
 from ..youtube_exceptions import InvalidJSON, YouTubeException
-from ...kodion.compatibility import available_cpu_count, string_type, to_str
+from ...kodion.compatibility import available_cpu_count, string_type
 from ...kodion.items import DirectoryItem
-from ...kodion.utils import (
-    datetime_parser,
-    strip_html_from_text,
-    to_unicode,
-)
+from ...kodion.utils import Pipeline, datetime_parser, strip_html_from_text
 
 
 class YouTube(LoginClient):
@@ -121,6 +116,93 @@ class YouTube(LoginClient):
         },
     }
 
+    _FEED_HEADERS = {
+        'Host': 'www.youtube.com',
+        'Connection': 'keep-alive',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+                      ' AppleWebKit/537.36 (KHTML, like Gecko)'
+                      ' Chrome/87.0.4280.66 Safari/537.36',
+        'Accept': 'text/html,'
+                  'application/xhtml+xml,'
+                  'application/xml;q=0.9,'
+                  'image/webp,*/*;q=0.8',
+        'DNT': '1',
+        'Accept-Encoding': 'gzip, deflate',
+        'Accept-Language': 'en-US,en;q=0.7,de;q=0.3'
+    }
+
+    # Partial response field masks for v3 requests, keyed by call site, see
+    # api_request. Each mask must include every field read from responses,
+    # and from the resources cached from them, by any user of the call site.
+    _FIELD_MASKS = {
+        'channels': (
+            'kind,etag,nextPageToken,pageInfo,'
+            'items('
+            'kind,id,'
+            'snippet(title,description,publishedAt,thumbnails,localized),'
+            'contentDetails/relatedPlaylists,'
+            'brandingSettings/image,'
+            'statistics'
+            ')'
+        ),
+        'playlists': (
+            'kind,etag,nextPageToken,pageInfo,'
+            'items('
+            'kind,id,'
+            'snippet(channelId,channelTitle,title,description,publishedAt,'
+            'thumbnails,localized),'
+            'contentDetails/itemCount,'
+            'status/podcastStatus'
+            ')'
+        ),
+        'videos': (
+            'kind,etag,nextPageToken,pageInfo,'
+            'items('
+            'kind,id,'
+            'snippet(channelId,channelTitle,title,description,publishedAt,'
+            'thumbnails,localized,liveBroadcastContent),'
+            'contentDetails/duration,'
+            'status/uploadStatus,'
+            'statistics,'
+            'liveStreamingDetails('
+            'actualStartTime,actualEndTime,scheduledStartTime'
+            ')'
+            ')'
+        ),
+    }
+
+    # Data API quota cost of requests in units, by path, or by method for
+    # other paths, and default quota available per API key each day. Quota
+    # used is recorded, see ApiQuota, and requests made in the background are
+    # deferred once only the reserved fraction of the daily quota remains.
+    _QUOTA_COSTS = {
+        'GET': 1,
+        'POST': 50,
+        'PUT': 50,
+        'DELETE': 50,
+        'search': 100,
+    }
+    _QUOTA_DAILY_UNITS = 10000
+    _QUOTA_RESERVE = 0.2
+
+    # Paths of listings whose responses are cached along with their ETag, and
+    # revalidated with a conditional request, see api_request. Resources
+    # requested by id, such as videos, channels and playlists, are already
+    # cached individually by ResourceManager, and are not cached again.
+    _ETAG_CACHE_PATHS = frozenset((
+        'playlistItems',
+        'subscriptions',
+    ))
+
+    # Key of the subscription list of the user in the data cache
+    _SUBSCRIPTIONS_CACHE_KEY = 'subscriptions.mine'
+
+    # Number of threads downloading subscription feeds. Fixed for the life of
+    # the process, so that the connection pool of the feed host is resized
+    # once, rather than replaced along with its open connections each time
+    # the subscriptions are listed.
+    _FEED_FETCH_WORKERS = min(32, 2 * (available_cpu_count() + 4))
+
     def __init__(self, context, **kwargs):
         self._context = context
         if 'items_per_page' in kwargs:
@@ -317,30 +399,192 @@ class YouTube(LoginClient):
 
     def unsubscribe(self, subscription_id, **kwargs):
         params = {'id': subscription_id}
-        return self.api_request(method='DELETE',
-                                path='subscriptions',
-                                params=params,
-                                no_content=True,
-                                **kwargs)
+        json_data = self.api_request(method='DELETE',
+                                     path='subscriptions',
+                                     params=params,
+                                     no_content=True,
+                                     **kwargs)
+        if json_data:
+            self._update_subscriptions(removed=subscription_id)
+        return json_data
 
     def unsubscribe_channel(self, channel_id, **kwargs):
         post_data = {'channelIds': [channel_id]}
-        return self.api_request(version=1,
-                                method='POST',
-                                path='subscription/unsubscribe',
-                                post_data=post_data,
-                                **kwargs)
+        json_data = self.api_request(version=1,
+                                     method='POST',
+                                     path='subscription/unsubscribe',
+                                     post_data=post_data,
+                                     **kwargs)
+        if json_data:
+            self._update_subscriptions(removed=channel_id)
+        return json_data
 
     def subscribe(self, channel_id, **kwargs):
         params = {'part': 'snippet'}
         post_data = {'kind': 'youtube#subscription',
                      'snippet': {'resourceId': {'kind': 'youtube#channel',
                                                 'channelId': channel_id}}}
-        return self.api_request(method='POST',
-                                path='subscriptions',
-                                params=params,
-                                post_data=post_data,
-                                **kwargs)
+        json_data = self.api_request(method='POST',
+                                     path='subscriptions',
+                                     params=params,
+                                     post_data=post_data,
+                                     **kwargs)
+        if json_data:
+            self._update_subscriptions(
+                added=(json_data.get('id'), channel_id),
+            )
+        return json_data
+
+    def _update_subscriptions(self, added=None, removed=None):
+        """
+        Applies a change to the subscriptions of the user to the cached
+        subscription list, if any, without syncing the list, and without
+        changing the time it was last synced
+        :param tuple added: (subscription id, channel id) of new subscription
+        :param str removed: subscription id or channel id of the subscription
+                            that was removed
+        """
+        data_cache = self._context.get_data_cache()
+        cached = data_cache.get_item(self._SUBSCRIPTIONS_CACHE_KEY,
+                                     as_dict=True)
+        if not cached or not cached['value']['pages']:
+            return
+        subscriptions = cached['value']
+        pages = subscriptions['pages']
+        if removed:
+            for page in pages:
+                page['items'] = [item for item in page['items']
+                                 if removed not in item]
+        if added:
+            pages[-1]['items'].append(added)
+        data_cache.update_item(
+            self._SUBSCRIPTIONS_CACHE_KEY,
+            subscriptions,
+            timestamp=datetime_parser.since_epoch() - cached['age'],
+        )
+
+    def _sync_subscriptions(self, cached_pages=None, **kwargs):
+        """
+        Generator of the ids of the channels the user is subscribed to, as
+        each page of subscriptions is received. Pages that were previously
+        cached are requested conditionally using their ETag, and the cached
+        page is used if it has not been modified. The synced list is stored
+        in the data cache once all pages have been received.
+        :param list cached_pages: pages of the cached subscription list
+        :raises YouTubeException: if a page could not be received, in which
+                                  case the ids generated are incomplete
+        """
+        cached_pages = cached_pages or []
+        params = {
+            'part': 'snippet',
+            # max page size, to sync in as few requests as possible
+            'maxResults': '50',
+            'order': 'alphabetical',
+            'mine': True,
+        }
+        synced_pages = []
+        page_token = None
+        while True:
+            idx = len(synced_pages)
+            if idx < len(cached_pages):
+                cached_page = cached_pages[idx]
+            else:
+                cached_page = None
+            if (cached_page
+                    and cached_page['token'] == page_token
+                    and cached_page['etag']):
+                json_data = self.api_request(
+                    method='GET',
+                    path='subscriptions',
+                    params=params,
+                    headers={'If-None-Match': cached_page['etag']},
+                    not_modified=cached_page,
+                    **kwargs
+                )
+            else:
+                cached_page = None
+                json_data = self.api_request(method='GET',
+                                             path='subscriptions',
+                                             params=params,
+                                             **kwargs)
+            if not json_data:
+                raise YouTubeException('Subscriptions sync incomplete')
+
+            if cached_page and json_data is cached_page:
+                page = cached_page
+            else:
+                page = {
+                    'token': page_token,
+                    'etag': json_data.get('etag'),
+                    'next': json_data.get('nextPageToken'),
+                    'items': [
+                        (item['id'],
+                         item['snippet']['resourceId']['channelId'])
+                        for item in json_data.get('items', [])
+                    ],
+                }
+            synced_pages.append(page)
+            for _, channel_id in page['items']:
+                yield channel_id
+
+            page_token = page['next']
+            if not page_token:
+                break
+            params = dict(params, pageToken=page_token)
+
+        self._context.get_data_cache().set_item(self._SUBSCRIPTIONS_CACHE_KEY,
+                                                {'pages': synced_pages})
+
+    def get_subscribed_channels(self, sync=False, **kwargs):
+        """
+        Lists the ids of the channels the user is subscribed to, from the
+        cached subscription list, without making any requests. The list is
+        synced first if it has not been cached yet, or if sync is True.
+        :return: iterable of channel ids, a generator if the list is synced
+        """
+        subscriptions = self._context.get_data_cache().get_item(
+            self._SUBSCRIPTIONS_CACHE_KEY
+        )
+        if subscriptions and not sync:
+            return [channel_id
+                    for page in subscriptions['pages']
+                    for _, channel_id in page['items']]
+        return self._sync_subscriptions(
+            subscriptions and subscriptions['pages'],
+            **kwargs
+        )
+
+    def sync_subscriptions(self, max_age=None, abort_check=None, **kwargs):
+        """
+        Syncs the cached subscription list, if it has not been synced within
+        the last max_age seconds
+        :param callable abort_check: called as subscriptions are received, if
+                                     it returns True the sync is abandoned,
+                                     and the cached list is left as it was
+        :return: False if the list is up to date, or the sync was abandoned
+                 or failed, True otherwise
+        """
+        data_cache = self._context.get_data_cache()
+        subscriptions = data_cache.get_item(self._SUBSCRIPTIONS_CACHE_KEY,
+                                            as_dict=True)
+        if subscriptions:
+            if max_age and subscriptions['age'] < max_age:
+                return False
+            cached_pages = subscriptions['value']['pages']
+        else:
+            cached_pages = None
+        pages = self._sync_subscriptions(cached_pages, **kwargs)
+        try:
+            for _ in pages:
+                if abort_check and abort_check():
+                    pages.close()
+                    return False
+        except YouTubeException as exc:
+            self._context.log_warning('YouTube.sync_subscriptions - Failed'
+                                      '\n\tException: {exc!r}'
+                                      .format(exc=exc))
+            return False
+        return True
 
     def get_subscription(self,
                          channel_id,
@@ -950,6 +1194,7 @@ class YouTube(LoginClient):
         return self.api_request(method='GET',
                                 path='channels',
                                 params=params,
+                                field_mask='channels',
                                 **kwargs)
 
     def get_disliked_videos(self, page_token='', **kwargs):
@@ -988,6 +1233,7 @@ class YouTube(LoginClient):
         return self.api_request(method='GET',
                                 path='videos',
                                 params=params,
+                                field_mask='videos',
                                 **kwargs)
 
     def get_playlists(self, playlist_id, **kwargs):
@@ -999,6 +1245,7 @@ class YouTube(LoginClient):
         return self.api_request(method='GET',
                                 path='playlists',
                                 params=params,
+                                field_mask='playlists',
                                 **kwargs)
 
     def get_live_events(self,
@@ -1513,8 +1760,84 @@ class YouTube(LoginClient):
                                  params=search_params,
                                  **kwargs))
 
+    def get_feed(self, channel_id, etag=None, last_modified=None):
+        """
+        Requests the feed of a channel. If the validators of the previously
+        downloaded feed are given, the request is conditional and the
+        response status is 304 if the feed has not been modified since.
+        """
+        headers = self._FEED_HEADERS
+        if etag or last_modified:
+            headers = headers.copy()
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return self.request(
+            'https://www.youtube.com/feeds/videos.xml?channel_id='
+            + channel_id,
+            headers=headers,
+        )
+
+    def fetch_feed(self, channel_id, etag=None, last_modified=None):
+        """
+        Conditionally downloads the feed of a channel, see get_feed, and parses
+        it as it is received. Safe to call from multiple threads.
+        :return: tuple of whether the feed was modified, None if the request
+                 failed, and dict of feed details if modified: channel name,
+                 validators of the response to use for conditional requests,
+                 and list of (video id, timestamp) tuples of the videos
+        """
+        response = self.get_feed(channel_id,
+                                 etag=etag,
+                                 last_modified=last_modified)
+        if not response:
+            return None, None
+        if response.status_code == 304:
+            return False, None
+        try:
+            channel_name, videos = parse_feed(response.content)
+        except ParseError as exc:
+            self._context.log_error('YouTube.fetch_feed - Error'
+                                    '\n\tChannel:   {channel_id}'
+                                    '\n\tException: {exc!r}'
+                                    .format(channel_id=channel_id, exc=exc))
+            return None, None
+        return True, {
+            'channel_name': channel_name,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'videos': videos,
+        }
+
+    def refresh_feeds(self, channel_ids):
+        """
+        Conditionally downloads the feeds of the given channels, one at a
+        time, and stores them in the feed history
+        :return: number of feeds refreshed
+        """
+        cache = self._context.get_feed_history()
+        cached = cache.get_items(channel_ids)
+        modified = {}
+        not_modified = {}
+        for channel_id in channel_ids:
+            details = cached.get(channel_id)
+            details = details['value'] if details else {}
+            is_modified, new_details = self.fetch_feed(
+                channel_id,
+                etag=details.get('etag'),
+                last_modified=details.get('last_modified'),
+            )
+            if is_modified:
+                modified[channel_id] = new_details
+            elif is_modified is False:
+                not_modified[channel_id] = details
+        cache.update_feeds(modified, not_modified)
+        return len(modified) + len(not_modified)
+
     def get_my_subscriptions(self,
-                             page_token=1,
+                             page_token=None,
+                             page=1,
                              logged_in=False,
                              do_filter=False,
                              refresh=False,
@@ -1551,397 +1874,221 @@ class YouTube(LoginClient):
         else:
             subscription_filters = None
 
-        page = page_token or 1
-        totals = {
-            'num': 0,
-            'start': -self.max_results(),
-            'end': page * self.max_results(),
-            'video_ids': set(),
-        }
-        totals['start'] += totals['end']
-
-        def _sort_by_date_time(item, limits):
-            video_id = item['id']
-            if video_id in limits['video_ids']:
-                return -1
-            limits['num'] += 1
-            limits['video_ids'].add(video_id)
-            return item['_timestamp']
-
-        threaded_output = {
-            'channel_ids': [],
-            'feeds': {},
-            'do_refresh': [],
-        }
-
-        params = {
-            'part': 'snippet',
-            'maxResults': str(self.max_results()),
-            'order': 'alphabetical',
-            'mine': True,
-        }
-
-        def _get_channels(output, _params=params):
-            json_data = self.api_request(method='GET',
-                                         path='subscriptions',
-                                         params=_params,
-                                         **kwargs)
-            if not json_data:
-                return False, True
-
-            output['channel_ids'].extend([{
-                'channel_id': item['snippet']['resourceId']['channelId']
-            } for item in json_data.get('items', [])])
-
-            subs_page_token = json_data.get('nextPageToken')
-            if subs_page_token:
-                _params['pageToken'] = subs_page_token
-                return True, False
-            return True, True
+        page = page or 1
 
+        bookmarked_ids = []
         bookmarks = self._context.get_bookmarks_list().get_items()
         if bookmarks:
-            channel_ids = threaded_output['channel_ids']
             for item_id, item in bookmarks.items():
                 if isinstance(item, DirectoryItem):
                     item_id = getattr(item, 'channel_id', None)
                 elif not isinstance(item, float):
                     continue
                 if item_id:
-                    channel_ids.append({'channel_id': item_id})
+                    bookmarked_ids.append(item_id)
 
-        headers = {
-            'Host': 'www.youtube.com',
-            'Connection': 'keep-alive',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
-                          ' AppleWebKit/537.36 (KHTML, like Gecko)'
-                          ' Chrome/87.0.4280.66 Safari/537.36',
-            'Accept': 'text/html,'
-                      'application/xhtml+xml,'
-                      'application/xml;q=0.9,'
-                      'image/webp,*/*;q=0.8',
-            'DNT': '1',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'en-US,en;q=0.7,de;q=0.3'
-        }
+        listed_ids = []
+
+        def _list_channels():
+            """
+            Generates the ids of bookmarked channels, followed by the ids of
+            subscribed channels. Subscriptions are read from the cached
+            subscription list, which is only synced if it has not been cached
+            yet, or on refresh, in which case ids are generated as each page
+            of subscriptions is received.
+            """
+            seen = set()
+            channel_ids = bookmarked_ids
+            if logged_in:
+                channel_ids = chain(
+                    channel_ids,
+                    self.get_subscribed_channels(sync=refresh, **kwargs),
+                )
+            for channel_id in channel_ids:
+                if channel_id not in seen:
+                    seen.add(channel_id)
+                    listed_ids.append(channel_id)
+                    yield channel_id
 
-        def _get_feed_cache(output,
-                            channel_id,
-                            _cache=cache,
-                            _refresh=refresh):
+        def _get_feed_cache(channel_id, _cache=cache, _refresh=refresh):
             cached = _cache.get_item(channel_id)
             if cached:
                 feed_details = cached['value']
-                _refresh = _refresh or cached['age'] > _cache.ONE_HOUR
+                _refresh = (_refresh
+                            or cached['age'] > _cache.get_refresh_interval(
+                                feed_details
+                            )
+                            # stored by a previous version, to be re-indexed
+                            or 'cached_items' in feed_details)
             else:
                 feed_details = {
                     'channel_name': None,
                     'cached_items': None,
                 }
                 _refresh = True
-
-            if _refresh:
-                output['do_refresh'].append({'channel_id': channel_id})
-                feed_details['refresh'] = True
-
-            feeds = output['feeds']
-            if channel_id in feeds:
-                feeds[channel_id].update(feed_details)
-            else:
-                feeds[channel_id] = feed_details
-
-            return True, False
-
-        def _get_feed(output, channel_id, _headers=headers):
-            _output = {
-                'content': self.request(
-                    'https://www.youtube.com/feeds/videos.xml?channel_id='
-                    + channel_id,
-                    headers=_headers,
-                ),
-                'refresh': True,
-            }
-
-            feeds = output['feeds']
-            if channel_id in feeds:
-                feeds[channel_id].update(_output)
+            feed_details['refresh'] = _refresh
+            return ((channel_id, feed_details),)
+
+        def _get_feed(item):
+            channel_id, feed = item
+            if feed['refresh']:
+                # feeds are parsed as they are downloaded, in the workers
+                feed['modified'], feed['details'] = self.fetch_feed(
+                    channel_id,
+                    etag=feed.get('etag'),
+                    last_modified=feed.get('last_modified'),
+                )
+            return (item,)
+
+        def _merge_feed(channel_id,
+                        feed,
+                        output,
+                        filters=subscription_filters):
+            channel_name = feed.get('channel_name')
+            cached_items = feed.get('cached_items')
+            is_modified = feed.get('modified')
+
+            # only channels whose feed was downloaded, or that still need
+            # to be moved into the feed index, are updated
+            if not feed['refresh'] or is_modified is None:
+                details = None
+            elif is_modified:
+                details = feed['details']
+                channel_name = details['channel_name']
+                output['modified'][channel_id] = details
             else:
-                feeds[channel_id] = _output
-
-            return True, False
-
-        namespaces = {
-            'atom': 'http://www.w3.org/2005/Atom',
-            'yt': 'http://www.youtube.com/xml/schemas/2015',
-            'media': 'http://search.yahoo.com/mrss/',
-        }
+                details = None
+                output['not_modified'][channel_id] = {
+                    'channel_name': channel_name,
+                    'etag': feed.get('etag'),
+                    'last_modified': feed.get('last_modified'),
+                }
 
-        def _parse_feeds(feeds,
-                         sort_method,
-                         sort_limits,
-                         progress_dialog=None,
-                         utf8=self._context.get_system_version().compatible(19),
-                         filters=subscription_filters,
-                         _ns=namespaces,
-                         _cache=cache):
-            if progress_dialog:
-                total = len(feeds)
-                progress_dialog.reset_total(new_total=total,
-                                            current=0,
-                                            total=total)
-
-            all_items = {}
-            new_cache = {}
-            for channel_id, feed in feeds.items():
-                channel_name = feed.get('channel_name')
-                cached_items = feed.get('cached_items')
-                refresh_feed = feed.get('refresh')
-                content = feed.get('content')
-
-                if refresh_feed and content:
-                    content.encoding = 'utf-8'
-                    content = to_unicode(content.content).replace('\n', '')
-
-                    root = ET.fromstring(content if utf8 else to_str(content))
-                    channel_name = (root.findtext('atom:title', '', _ns)
-                                    .lower().replace(',', ''))
-                    feed_items = [{
-                        'kind': 'youtube#video',
-                        'id': item.findtext('yt:videoId', '', _ns),
-                        'snippet': {
-                            'channelId': channel_id,
-                        },
-                        '_timestamp': datetime_parser.since_epoch(
-                            datetime_parser.strptime(
-                                item.findtext('atom:published', '', _ns)
-                            )
-                        ),
-                        '_partial': True,
-                    } for item in root.findall('atom:entry', _ns)]
+            # stored by a previous version
+            if cached_items:
+                feed_items = [
+                    (item['id'], item['_timestamp'])
+                    for item in cached_items
+                ]
+                if details:
+                    details['videos'].extend(feed_items)
                 else:
-                    feed_items = []
-
-                if feed_items:
-                    if cached_items:
-                        feed_items.extend(cached_items)
-                    feed_limits = {
-                        'num': 0,
-                        'video_ids': set(),
-                    }
-                    feed_items.sort(reverse=True,
-                                    key=partial(sort_method,
-                                                limits=feed_limits))
-                    feed_items = feed_items[:min(1000, feed_limits['num'])]
-                    new_cache[channel_id] = {
+                    output['previous_cache'][channel_id] = {
                         'channel_name': channel_name,
-                        'cached_items': feed_items,
+                        'videos': feed_items,
                     }
-                elif cached_items:
-                    feed_items = cached_items
-                else:
-                    continue
-                if filters:
-                    filtered = channel_name and channel_name in filters['set']
-                    if filters['blacklist']:
-                        if not filtered:
-                            all_items[channel_id] = feed_items
-                    elif filtered:
-                        all_items[channel_id] = feed_items
-                else:
-                    all_items[channel_id] = feed_items
-
-                if progress_dialog:
-                    progress_dialog.update(current=len(all_items))
-
-            if new_cache:
-                _cache.set_items(new_cache)
-            # filter, sorting by publish date and trim
-            if all_items:
-                return sorted(
-                    chain.from_iterable(all_items.values()),
-                    reverse=True,
-                    key=partial(sort_method, limits=sort_limits),
-                )
-            return None
-
-        def _threaded_fetch(kwargs,
-                            output,
-                            worker,
-                            threads,
-                            pool_id,
-                            input_wait,
-                            **_kwargs):
-            complete = False
-            while not threads['balance'].is_set():
-                threads['loop'].set()
-                if kwargs is True:
-                    _kwargs = {}
-                elif kwargs:
-                    _kwargs = kwargs.pop()
-                elif input_wait:
-                    input_wait.acquire(True)
-                    input_wait.release()
-                    if kwargs:
-                        continue
-                    break
-                else:
-                    complete = True
-                    break
 
-                try:
-                    success, complete = worker(output, **_kwargs)
-                except Exception as exc:
-                    msg = ('get_my_subscriptions._threaded_fetch - Error'
-                           '\n\tException: {exc!r}'
-                           '\n\tStack trace (most recent call last):\n{stack}'
-                           .format(exc=exc,
-                                   stack=''.join(format_stack())))
-                    self._context.log_error(msg)
-                    continue
-
-                if complete or not success:
-                    break
+            if filters:
+                filtered = channel_name and channel_name in filters['set']
+                if filters['blacklist']:
+                    if not filtered:
+                        output['channel_ids'].append(channel_id)
+                elif filtered:
+                    output['channel_ids'].append(channel_id)
             else:
-                threads['balance'].clear()
-
-            threads['counter'].release()
-            if complete:
-                threads['counts'][pool_id] = None
-            else:
-                threads['counts'][pool_id] -= 1
-            threads['counts']['all'] -= 1
-            threads['current'].discard(threading.current_thread())
-            threads['loop'].set()
-
-        max_threads = min(32, 2 * (available_cpu_count() + 4))
-        counts = {
-            'all': 0,
-        }
-        current_threads = set()
-        counter = threading.Semaphore(max_threads)
-        balance_enable = threading.Event()
-        loop_enable = threading.Event()
-        threads = {
-            'balance': balance_enable,
-            'loop': loop_enable,
-            'counter': counter,
-            'counts': counts,
-            'current': current_threads,
-        }
-
-        payloads = {}
-        if logged_in:
-            payloads[1] = {
-                'worker': _get_channels,
-                'kwargs': True,
-                'output': threaded_output,
-                'threads': threads,
-                'limit': 1,
-                'input_wait': None,
-                'input_wait_for': None,
-            }
-        payloads.update({
-            2: {
-                'worker': _get_feed_cache,
-                'kwargs': threaded_output['channel_ids'],
-                'output': threaded_output,
-                'threads': threads,
-                'limit': 1,
-                'input_wait': threading.Lock(),
-                'input_wait_for': 1,
-            },
-            3: {
-                'worker': _get_feed,
-                'kwargs': threaded_output['do_refresh'],
-                'output': threaded_output,
-                'threads': threads,
-                'limit': None,
-                'input_wait': threading.Lock(),
-                'input_wait_for': 2,
-            },
-        })
-
-        completed = []
-        iterator = iter(payloads)
-        loop_enable.set()
-        while loop_enable.wait():
-            try:
-                pool_id = next(iterator)
-            except StopIteration:
-                loop_enable.clear()
-                if not current_threads:
-                    break
-                for pool_id in completed:
-                    del payloads[pool_id]
-                completed = []
-                iterator = iter(payloads)
-                if progress_dialog:
-                    total = progress_dialog.grow_total(
-                        new_total=len(threaded_output['channel_ids']),
-                    )
-                    progress_dialog.update(
-                        steps=0,
-                        current=len(threaded_output['feeds']),
-                        total=total,
-                    )
-                continue
-
-            payload = payloads[pool_id]
-            payload['pool_id'] = pool_id
-            current_num = counts.setdefault(pool_id, 0)
-            if current_num is None:
-                completed.append(pool_id)
-                continue
-
-            if payload['kwargs']:
-                input_wait = payload['input_wait']
-                if input_wait and input_wait.locked():
-                    input_wait.release()
-            else:
-                input_wait_for = payload['input_wait_for']
-                if not input_wait_for or input_wait_for not in payloads:
-                    completed.append(pool_id)
-                continue
-
-            available = max_threads - counts['all']
-            limit = payload['limit']
-            if limit:
-                if current_num >= limit:
-                    continue
-                if available <= 0:
-                    balance_enable.set()
-            elif available <= 0:
-                continue
-
-            new_thread = threading.Thread(
-                target=_threaded_fetch,
-                kwargs=payload,
-            )
-            new_thread.daemon = True
-            current_threads.add(new_thread)
-            counts[pool_id] += 1
-            counts['all'] += 1
-            counter.acquire(True)
-            new_thread.start()
-
-        items = _parse_feeds(
-            threaded_output['feeds'],
-            sort_method=_sort_by_date_time,
-            sort_limits=totals,
-            progress_dialog=progress_dialog,
+                output['channel_ids'].append(channel_id)
+
+        # subscriptions are listed, looked up in the feed history, and
+        # downloaded and parsed concurrently, while the results are merged
+        num_fetch_workers = self._FEED_FETCH_WORKERS
+        # one connection per worker, for workers not to wait on each other.
+        # Only resized by the first listing in the process.
+        self.set_pool_size('www.youtube.com', num_fetch_workers)
+        pipeline = Pipeline(
+            source=_list_channels(),
+            stages=(
+                ('cache', _get_feed_cache, 1),
+                ('fetch', _get_feed, num_fetch_workers),
+            ),
+            abort_check=self._context.abort_requested,
         )
-        if not items:
+        merged = {
+            'channel_ids': [],
+            'modified': {},
+            'not_modified': {},
+            'previous_cache': {},
+        }
+        num_feeds = 0
+        for channel_id, feed in pipeline.run(consumer='merge'):
+            _merge_feed(channel_id, feed, merged)
+            num_feeds += 1
+            if progress_dialog:
+                total = progress_dialog.grow_total(new_total=len(listed_ids))
+                progress_dialog.update(current=num_feeds, total=total)
+
+        self._context.log_debug('get_my_subscriptions - Pipeline{0}'.format(
+            ''.join([
+                '\n\t{name}: {items_in} in, {items_out} out,'
+                ' {busy:.3f}s busy, {blocked:.3f}s blocked'.format(
+                    name=name,
+                    items_in=stats['items_in'],
+                    items_out=stats['items_out'],
+                    busy=stats['busy'],
+                    blocked=stats['blocked'],
+                )
+                for name, stats in pipeline.stats().items()
+                if 'busy' in stats
+            ] + [
+                '\n\t{host}: {requests} requests,'
+                ' {connections}/{max_connections} connections,'
+                ' {wait_time:.3f}s waiting, {max_wait:.3f}s max wait'.format(
+                    host=host,
+                    **stats
+                )
+                for host, stats in self.get_pool_stats().items()
+            ])
+        ))
+        if pipeline.is_cancelled():
             return None
 
-        if totals['num'] > totals['end']:
-            v3_response['nextPageToken'] = page + 1
-        if totals['num'] > totals['start']:
-            items = items[totals['start']:min(totals['num'], totals['end'])]
+        # the subscription list or the feeds may be incomplete, and are not
+        # stored, so that channels are not dropped from the feed history
+        if pipeline.is_failed():
+            self._context.log_warning('get_my_subscriptions'
+                                      ' - Incomplete, feed history not updated'
+                                      '\n\tChannels: {listed}'
+                                      '\n\tFeeds:    {feeds}'
+                                      .format(listed=len(listed_ids),
+                                              feeds=num_feeds))
         else:
+            cache.update_feeds(merged['modified'], merged['not_modified'])
+            if merged['previous_cache']:
+                cache.set_items(merged['previous_cache'])
+            # channels are recorded for their feeds to be kept up to date by
+            # the service, see FeedHistory.get_stale_channels
+            if num_feeds:
+                cache.set_channels(listed_ids)
+
+        channel_ids = merged['channel_ids']
+        if not channel_ids:
             return None
 
-        v3_response['pageInfo']['totalResults'] = totals['num']
-        v3_response['items'] = items
+        # pages of the merged feed are read directly from the feed index,
+        # resuming from the position in each channel feed reached by the
+        # previous page, if available
+        max_results = self.max_results()
+        offset = (page - 1) * max_results
+        rows, next_page_token = cache.get_feed_page(channel_ids,
+                                                    limit=max_results,
+                                                    offset=offset,
+                                                    page_cursor=page_token)
+        if not rows:
+            return None
+        if next_page_token:
+            v3_response['nextPageToken'] = next_page_token
+
+        v3_response['pageInfo']['totalResults'] = (
+                offset + len(rows) + (1 if next_page_token else 0)
+        )
+        v3_response['items'] = [{
+            'kind': 'youtube#video',
+            'id': video_id,
+            'snippet': {
+                'channelId': channel_id,
+            },
+            '_timestamp': timestamp,
+            '_partial': True,
+        } for video_id, channel_id, timestamp in rows]
         return v3_response
 
     def get_saved_playlists(self, page_token, offset):
@@ -2102,6 +2249,9 @@ class YouTube(LoginClient):
                                 '\n\theaders: |{0.headers}|'.format(response))
         if response.status_code == 204 and 'no_content' in kwargs:
             return True
+        # conditional request, returns the cached data passed by the caller
+        if response.status_code == 304 and 'not_modified' in kwargs:
+            return kwargs['not_modified']
         try:
             json_data = response.json()
             if 'error' in json_data:
@@ -2174,7 +2324,21 @@ class YouTube(LoginClient):
                     post_data=None,
                     headers=None,
                     no_login=False,
+                    field_mask=None,
+                    background=False,
                     **kwargs):
+        """
+        :param str field_mask: name of the partial response field mask of the
+                               call site, see _FIELD_MASKS, to limit the
+                               fields of the response to those that are used
+        :param bool background: whether the request was not made by the user,
+                                in which case it is deferred, and an empty
+                                response returned, if the quota remaining for
+                                the day is low, see _quota_available
+        """
+        if field_mask and version == 3:
+            params = dict(params or {}, fields=self._FIELD_MASKS[field_mask])
+
         client_data = {
             '_endpoint': path.strip('/'),
             'method': method,
@@ -2221,6 +2385,29 @@ class YouTube(LoginClient):
         if clear_data and 'json' in client:
             del client['json']
 
+        context = self._context
+
+        # responses to GET requests for listings are cached along with their
+        # ETag, and are revalidated with a conditional request, unless the
+        # caller is making its own conditional request
+        cache_key = None
+        if (not abort
+                and version == 3
+                and method == 'GET'
+                and path.strip('/') in self._ETAG_CACHE_PATHS
+                and 'not_modified' not in kwargs):
+            cache_key = self._api_cache_key(
+                path,
+                params,
+                authorised=bool(client.get('_access_token')),
+            )
+            data_cache = context.get_data_cache()
+            cached = data_cache.get_item(cache_key)
+            if cached:
+                client['headers'] = dict(client.get('headers') or {})
+                client['headers']['If-None-Match'] = cached['etag']
+                kwargs['not_modified'] = cached['json_data']
+
         if params:
             log_params = params.copy()
             if 'location' in log_params:
@@ -2239,7 +2426,6 @@ class YouTube(LoginClient):
         else:
             log_headers = None
 
-        context = self._context
         context.log_debug('API request:'
                           '\n\tversion:   |{version}|'
                           '\n\tmethod:    |{method}|'
@@ -2258,7 +2444,84 @@ class YouTube(LoginClient):
                 context.get_ui().on_ok(context.get_name(), context.localize('key.requirement'))
             context.log_warning('API request: aborted')
             return {}
-        return self.request(response_hook=self._response_hook,
-                            response_hook_kwargs=kwargs,
-                            error_hook=self._error_hook,
-                            **client)
+
+        if version == 3:
+            quota = context.get_api_quota()
+            quota_key_id = self._quota_key_id(client)
+            units = self._quota_cost(method, path)
+            if background and not self._quota_available(quota,
+                                                        quota_key_id,
+                                                        units):
+                context.log_notice('API request: deferred, quota low')
+                return {}
+        else:
+            quota = None
+
+        json_data = self.request(response_hook=self._response_hook,
+                                 response_hook_kwargs=kwargs,
+                                 error_hook=self._error_hook,
+                                 **client)
+        if quota:
+            quota.record(quota_key_id,
+                         ' '.join((method, path.strip('/'))),
+                         units)
+        if (cache_key
+                and isinstance(json_data, dict)
+                and json_data is not kwargs.get('not_modified')
+                and json_data.get('etag')
+                and 'error' not in json_data):
+            data_cache.set_item(cache_key, {
+                'etag': json_data['etag'],
+                'json_data': json_data,
+            })
+        return json_data
+
+    def _quota_key_id(self, client):
+        """
+        Id of the API key of the project that the quota used by a request is
+        counted against: the key of the request, or the key of the config
+        that the access token of the request was issued for
+        """
+        params = client.get('params')
+        if params and params.get('key'):
+            key = params['key']
+        elif client.get('_access_token') == self._access_token:
+            key = self._config.get('key')
+        else:
+            key = self._config_tv.get('key')
+        if not key:
+            return 'unknown'
+        return md5(key.encode('utf-8')).hexdigest()[:8]
+
+    @classmethod
+    def _quota_cost(cls, method, path):
+        path = path.strip('/')
+        if path in cls._QUOTA_COSTS:
+            return cls._QUOTA_COSTS[path]
+        return cls._QUOTA_COSTS.get(method, 1)
+
+    @classmethod
+    def _quota_available(cls, quota, key_id, units):
+        """
+        Whether a background request can be made without using the units
+        reserved for requests made by the user
+        """
+        used = quota.get_usage(key_id)['total']
+        reserve = cls._QUOTA_DAILY_UNITS * cls._QUOTA_RESERVE
+        return used + units <= cls._QUOTA_DAILY_UNITS - reserve
+
+    @staticmethod
+    def _api_cache_key(path, params, authorised=False):
+        """
+        Key of a cached API response, from the request path and params, in
+        any order, excluding the API key. Responses are cached in the data
+        cache of the current user, and responses to requests made with and
+        without authorisation are cached separately.
+        """
+        if params and 'key' in params:
+            params = params.copy()
+            del params['key']
+        return 'api_response.' + md5(json.dumps(
+            [path.strip('/'), params, authorised],
+            sort_keys=True,
+        ).encode('utf-8')).hexdigest()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import xml.etree.ElementTree as ET
+from io import BytesIO
+
+from ...kodion.utils import datetime_parser, to_unicode
+
+
+__all__ = (
+    'ParseError',
+    'parse_feed',
+)
+
+ParseError = ET.ParseError
+
+_ATOM_NS = '{http://www.w3.org/2005/Atom}'
+_YT_NS = '{http://www.youtube.com/xml/schemas/2015}'
+
+_ENTRY = _ATOM_NS + 'entry'
+_PUBLISHED = _ATOM_NS + 'published'
+_TITLE = _ATOM_NS + 'title'
+_VIDEO_ID = _YT_NS + 'videoId'
+
+
+def parse_feed(content):
+    """
+    Incrementally parses a channel Atom feed, as returned by
+    https://www.youtube.com/feeds/videos.xml, directly from the response
+    bytes. Only the channel title, and the id and date published of each
+    video are read. Entries are freed as soon as they have been read.
+    :param bytes content: response body
+    :return: tuple of channel name, and list of (video id, timestamp) tuples
+             of the videos of the feed
+    :raises ParseError: if the feed is not well-formed
+    """
+    channel_name = None
+    videos = []
+    video_id = published = None
+    root = None
+    in_entry = False
+
+    for event, element in ET.iterparse(BytesIO(content),
+                                       events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if root is None:
+                root = element
+            elif tag == _ENTRY:
+                in_entry = True
+                video_id = published = None
+            continue
+
+        if tag == _ENTRY:
+            if video_id and published:
+                videos.append((
+                    video_id,
+                    datetime_parser.rfc3339_since_epoch(published),
+                ))
+            in_entry = False
+            root.clear()
+        elif not in_entry:
+            if tag == _TITLE and channel_name is None:
+                channel_name = to_unicode(element.text or '')
+        elif tag == _VIDEO_ID:
+            video_id = element.text
+        elif tag == _PUBLISHED:
+            published = element.text
+
+    if channel_name:
+        channel_name = (channel_name.replace('\n', '')
+                        .lower().replace(',', ''))
+    return channel_name or '', videos
@@ -10,8 +10,20 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from functools import partial
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from ...kodion.utils import SingleFlight
+
 
 class ResourceManager(object):
+    # In-flight requests by client, so that concurrent requests for the same
+    # resource ids are only made once, and only shared by requests made with
+    # the same user, API key and access tokens
+    _single_flight = WeakKeyDictionary()
+    _single_flight_lock = Lock()
+
     def __init__(self, provider, context):
         self._context = context
         fanart_type = context.get_param('fanart_type')
@@ -31,7 +43,91 @@ class ResourceManager(object):
         for i in range(0, len(input_list), n):
             yield input_list[i:i + n]
 
-    def get_channels(self, ids, defer_cache=False):
+    @classmethod
+    def _get_single_flight(cls, client, resource_type):
+        with cls._single_flight_lock:
+            registry = cls._single_flight.get(client)
+            if registry is None:
+                registry = cls._single_flight[client] = {}
+            single_flight = registry.get(resource_type)
+            if single_flight is None:
+                single_flight = registry[resource_type] = SingleFlight(
+                    resource_type
+                )
+        return single_flight
+
+    def _update_data(self,
+                     resource_type,
+                     client,
+                     request,
+                     to_update,
+                     result,
+                     defer_cache=False,
+                     mark_unavailable=False):
+        """
+        Requests the resources with the given ids, and adds them to result.
+        Ids already being requested by another thread are waited for rather
+        than requested again. Any of those ids that the other request did
+        not return, because it failed or was deferred, are then requested.
+        :param str resource_type: type of resource, used as single flight key
+        :param client: client the requests are made with
+        :param callable request: called with each batch of up to 50 ids,
+                                 returns the response for the batch
+        :param list to_update: ids of the resources to request
+        :param dict result: dict of resources to update
+        :param bool defer_cache: defer storing new resources, see cache_data
+        :param bool mark_unavailable: store a placeholder for requested ids
+                                      that are missing from the responses
+        """
+        context = self._context
+        single_flight = self._get_single_flight(client, resource_type)
+        while to_update:
+            to_update, in_flight = single_flight.acquire(to_update)
+            new_data = None
+            try:
+                if to_update:
+                    batches = [
+                        request(list_of_50)
+                        for list_of_50 in self._list_batch(to_update, n=50)
+                    ]
+                    if any(batches):
+                        new_data = {
+                            yt_item['id']: yt_item
+                            for batch in batches
+                            if batch
+                            for yt_item in batch.get('items', [])
+                            if yt_item
+                        }
+                        if mark_unavailable:
+                            for id_ in to_update:
+                                if id_ not in new_data:
+                                    new_data[id_] = {'_unavailable': True}
+            finally:
+                single_flight.release(to_update, new_data)
+
+            if new_data:
+                context.debug_log and context.log_debug(
+                    'ResourceManager._update_data'
+                    ' - Retrieved new data for {type}'
+                    '\n\tIDs: {ids}'
+                    .format(type=resource_type, ids=to_update)
+                )
+                result.update(new_data)
+                self.cache_data(new_data, defer=defer_cache)
+
+            if not in_flight:
+                break
+            context.debug_log and context.log_debug(
+                'ResourceManager._update_data'
+                ' - Waiting for in-flight requests for {type}'
+                '\n\tIDs: {ids}'
+                .format(type=resource_type, ids=list(in_flight))
+            )
+            shared = single_flight.wait(in_flight)
+            result.update(shared)
+            to_update = [id_ for id_ in in_flight if id_ not in shared]
+
+    def get_channels(self, ids, defer_cache=False, background=False):
         context = self._context
         client = self._provider.get_client(context)
         data_cache = context.get_data_cache()
@@ -50,6 +146,7 @@ class ResourceManager(object):
                 client.get_channel_by_identifier,
                 function_cache.ONE_DAY,
                 _refresh=refresh,
+                _stale_ok=True,
                 identifier=identifier,
             ) or {}
             items = data.get('items')
@@ -82,28 +179,14 @@ class ResourceManager(object):
             )
 
         if to_update:
-            new_data = [client.get_channels(list_of_50)
-                        for list_of_50 in self._list_batch(to_update, n=50)]
-            if not any(new_data):
-                new_data = None
-        else:
-            new_data = None
-
-        if new_data:
-            context.debug_log and context.log_debug(
-                'ResourceManager.get_channels'
-                ' - Retrieved new data for channels'
-                '\n\tVideo IDs: {ids}'
-                .format(ids=to_update)
+            self._update_data(
+                'channels',
+                client,
+                partial(client.get_channels, background=background),
+                to_update,
+                result,
+                defer_cache=defer_cache,
             )
-            new_data = {
-                yt_item['id']: yt_item
-                for batch in new_data
-                for yt_item in batch.get('items', [])
-                if yt_item
-            }
-            result.update(new_data)
-            self.cache_data(new_data, defer=defer_cache)
 
         # Re-sort result to match order of requested IDs
         # Will only work in Python v3.7+
@@ -122,7 +205,10 @@ class ResourceManager(object):
         elif self._fanart_type != self._context.get_settings().FANART_CHANNEL:
             return {}
 
-        result = self.get_channels(channel_ids, defer_cache=defer_cache)
+        # fanart is not essential, and is only fetched if enough quota remains
+        result = self.get_channels(channel_ids,
+                                   defer_cache=defer_cache,
+                                   background=True)
         banners = (
             'bannerTvMediumImageUrl',
             'bannerTvLowImageUrl',
@@ -167,28 +253,14 @@ class ResourceManager(object):
 
         if to_update:
             client = self._provider.get_client(context)
-            new_data = [client.get_playlists(list_of_50)
-                        for list_of_50 in self._list_batch(to_update, n=50)]
-            if not any(new_data):
-                new_data = None
-        else:
-            new_data = None
-
-        if new_data:
-            context.debug_log and context.log_debug(
-                'ResourceManager.get_playlists'
-                ' - Retrieved new data for playlists'
-                '\n\tVideo IDs: {ids}'
-                .format(ids=to_update)
+            self._update_data(
+                'playlists',
+                client,
+                client.get_playlists,
+                to_update,
+                result,
+                defer_cache=defer_cache,
             )
-            new_data = {
-                yt_item['id']: yt_item
-                for batch in new_data
-                for yt_item in batch.get('items', [])
-                if yt_item
-            }
-            result.update(new_data)
-            self.cache_data(new_data, defer=defer_cache)
 
         # Re-sort result to match order of requested IDs
         # Will only work in Python v3.7+
@@ -336,33 +408,18 @@ class ResourceManager(object):
         if to_update:
             notify_and_raise = not suppress_errors
             client = self._provider.get_client(context)
-            new_data = [client.get_videos(list_of_50,
-                                          live_details,
-                                          notify=notify_and_raise,
-                                          raise_exc=notify_and_raise)
-                        for list_of_50 in self._list_batch(to_update, n=50)]
-            if not any(new_data):
-                new_data = None
-        else:
-            new_data = None
-
-        if new_data:
-            context.debug_log and context.log_debug(
-                'ResourceManager.get_videos'
-                ' - Retrieved new data for videos'
-                '\n\tVideo IDs: {ids}'
-                .format(ids=to_update)
+            self._update_data(
+                'live_videos' if live_details else 'videos',
+                client,
+                partial(client.get_videos,
+                        live_details=live_details,
+                        notify=notify_and_raise,
+                        raise_exc=notify_and_raise),
+                to_update,
+                result,
+                defer_cache=defer_cache,
+                mark_unavailable=True,
             )
-            new_data = {
-                yt_item['id']: yt_item
-                for batch in new_data
-                for yt_item in batch.get('items', [])
-                if yt_item
-            }
-            new_data = dict(dict.fromkeys(to_update, {'_unavailable': True}),
-                            **new_data)
-            result.update(new_data)
-            self.cache_data(new_data, defer=defer_cache)
 
         # Re-sort result to match order of requested IDs
         # Will only work in Python v3.7+
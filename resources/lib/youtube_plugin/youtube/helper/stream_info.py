@@ -14,6 +14,11 @@ import json
 import os
 import random
 import re
+import socket
+from functools import partial
+from hashlib import md5
+from threading import Event, Lock, Thread
+from time import time
 from traceback import format_stack
 
 from .ratebypass import ratebypass
@@ -25,6 +30,7 @@ from ..youtube_exceptions import InvalidJSON, YouTubeException
 from ...kodion.compatibility import (
     entity_escape,
     parse_qs,
+    perf_counter,
     quote,
     unescape,
     unquote,
@@ -34,11 +40,210 @@ from ...kodion.compatibility import (
     urlunsplit,
     xbmcvfs,
 )
-from ...kodion.constants import PATHS, TEMP_PATH
+from ...kodion.constants import PATHS, PLAY_PROMPT_SUBTITLES, TEMP_PATH
 from ...kodion.network import get_connect_address
 from ...kodion.utils import make_dirs, redact_ip
 
 
+class _Cancelled(Exception):
+    """
+    Raised in the thread of a player request that was abandoned, to stop it
+    without logging an error
+    """
+
+
+class _PlayerRequests(object):
+    """
+    Makes player requests for a list of candidate clients, in priority order,
+    keeping up to a number of requests in flight ahead of the response that is
+    currently needed. A fallback to the next client, or the request for the
+    next group of clients, then does not have to wait for a full round trip.
+    Requests are keyed by client and whether they are authorised, and are
+    made with the client data current when started. Requests still in flight
+    when closed are cancelled.
+    """
+
+    def __init__(self, stream_info, url, video_id, candidates, max_requests):
+        """
+        :param StreamInfo stream_info: used to build clients and make requests
+        :param str url: player request url
+        :param str video_id: id of the video the requests are for
+        :param list candidates: names of clients, in the order they may be
+                                needed
+        :param int max_requests: max number of requests in flight, 1 to make
+                                 requests one at a time, as they are needed
+        """
+        self._stream_info = stream_info
+        self._url = url
+        self._video_id = video_id
+        self._candidates = candidates
+        self._max_requests = max(1, max_requests)
+        self._requests = {}
+
+    @staticmethod
+    def _close_response(response):
+        # Closing the response does not interrupt a read in progress in the
+        # thread of the request, so the socket is shut down first
+        connection = getattr(response.raw, 'connection', None)
+        sock = connection and connection.sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
+        response.close()
+
+    @classmethod
+    def _on_response(cls, request):
+        """
+        Response event hook, called once the response headers are received,
+        before the response body is read. The response is kept so that it can
+        be closed by close(), and is closed straight away if the request has
+        already been cancelled.
+        """
+        def _hook(response, **_kwargs):
+            request['response'] = response
+            if request['cancelled']:
+                cls._close_response(response)
+                raise _Cancelled
+            return response
+
+        return _hook
+
+    def _error_hook(self, request, **kwargs):
+        # errors caused by closing the response of a cancelled request
+        if request['cancelled']:
+            raise _Cancelled
+        return self._stream_info._error_hook(**kwargs)
+
+    def _request(self, request):
+        stream_info = self._stream_info
+        start = perf_counter()
+        result = {}
+        try:
+            result = stream_info.request(
+                self._url,
+                'POST',
+                hooks={'response': self._on_response(request)},
+                response_hook=stream_info._response_hook_json,
+                error_title='Player request failed',
+                error_hook=partial(self._error_hook, request),
+                error_hook_kwargs={
+                    'video_id': self._video_id,
+                    'client': request['name'],
+                    'auth': request['auth'],
+                },
+                **request['client']
+            ) or {}
+        # raised again when the response is needed, as for a request made in
+        # the thread that needs it
+        except Exception as exc:
+            request['exc'] = exc
+        finally:
+            request['time'] = perf_counter() - start
+            request['result'] = result
+            request['response'] = None
+            request['done'].set()
+
+        # counted as abandoned by close()
+        if request['cancelled']:
+            return
+        status = result.get('playabilityStatus', {}).get('status')
+        stream_info.record_client_stats(request['name'],
+                                        time=request['time'],
+                                        ok=status == 'OK')
+
+    def _start(self, client_name, client_data):
+        auth = bool(client_data.get('_access_token'))
+        key = (client_name, auth)
+        request = self._requests.get(key)
+        if request:
+            return request
+
+        request = self._requests[key] = {
+            'name': client_name,
+            'auth': auth,
+            'client': self._stream_info.build_client(client_name,
+                                                     client_data),
+            'result': None,
+            'time': None,
+            'used': False,
+            'exc': None,
+            'done': Event(),
+            'cancelled': False,
+            'response': None,
+        }
+        if request['client']:
+            thread = Thread(target=self._request, args=(request,))
+            thread.daemon = True
+            thread.start()
+        else:
+            request['done'].set()
+        return request
+
+    def get(self, client_name, client_data):
+        """
+        Starts the request for a client, unless already started, along with
+        the requests for the clients that follow it, up to the max number of
+        requests in flight, and waits for the response
+        :return: tuple of client, None if the client is disabled, and player
+                 response
+        """
+        request = self._start(client_name, client_data)
+        candidates = self._candidates
+        if client_name in candidates:
+            num_requests = 1
+            idx = candidates.index(client_name) + 1
+            for next_client in candidates[idx:]:
+                if num_requests >= self._max_requests:
+                    break
+                # disabled clients are skipped without making a request
+                if self._start(next_client, client_data)['client']:
+                    num_requests += 1
+
+        request['done'].wait()
+        request['used'] = True
+        if request['exc']:
+            raise request['exc']
+        return request['client'], request['result'] or {}
+
+    def close(self):
+        """
+        Cancels requests that are still in flight, closing their responses if
+        already received, so that their connections are not kept busy reading
+        responses that will not be used, and logs the time taken by each
+        request
+        """
+        stream_info = self._stream_info
+        timings = []
+        for request in self._requests.values():
+            if not request['client']:
+                continue
+            if request['done'].is_set():
+                timings.append('{name}{auth}: {time:.3f}s{unused}'.format(
+                    name=request['name'],
+                    auth=' (auth)' if request['auth'] else '',
+                    time=request['time'],
+                    unused='' if request['used'] else ', unused',
+                ))
+            else:
+                request['cancelled'] = True
+                response = request['response']
+                if response is not None:
+                    self._close_response(response)
+                timings.append('{name}{auth}: abandoned'.format(
+                    name=request['name'],
+                    auth=' (auth)' if request['auth'] else '',
+                ))
+                stream_info.record_client_stats(request['name'],
+                                                abandoned=True)
+        stream_info.log_debug('Player requests:'
+                              '\n\tvideo_id: |{video_id}|'
+                              '\n\t{timings}'
+                              .format(video_id=self._video_id,
+                                      timings='\n\t'.join(timings)))
+
+
 class StreamInfo(YouTubeRequestClient):
     BASE_PATH = make_dirs(TEMP_PATH)
 
@@ -682,6 +887,18 @@ class StreamInfo(YouTubeRequestClient):
         'dtse': 1.3,
     }
 
+    # Max number of player requests in flight at once, see _PlayerRequests.
+    # 1 to only request a client once the response of the previous one has
+    # been checked.
+    _max_player_requests = 2
+    # Counters of player requests by client, see get_client_stats
+    _client_stats = {}
+    _client_stats_lock = Lock()
+    # Cached streams are only used if their URLs remain valid for at least
+    # this many seconds, so that playback can complete before they expire
+    _cache_margin = 60 * 60
+    _EXPIRE_RE = re.compile(r'[?&;/]expire[=/](\d+)')
+
     def __init__(self,
                  context,
                  access_token='',
@@ -703,6 +920,9 @@ class StreamInfo(YouTubeRequestClient):
         self._calculate_n = True
         self._cipher = None
 
+        self._expiry = None
+        self._manifest = None
+
         self._selected_client = None
         self._client_groups = {
             'custom': clients if clients else (),
@@ -725,6 +945,41 @@ class StreamInfo(YouTubeRequestClient):
         }
 
         super(StreamInfo, self).__init__(context=context, **kwargs)
+        context.add_stats_source('player_clients', self.get_client_stats)
+
+    @classmethod
+    def record_client_stats(cls, client_name, time=0, ok=False,
+                            abandoned=False):
+        with cls._client_stats_lock:
+            stats = cls._client_stats.get(client_name)
+            if not stats:
+                stats = cls._client_stats[client_name] = {
+                    'requests': 0,
+                    'ok': 0,
+                    'abandoned': 0,
+                    'time': 0,
+                }
+            if abandoned:
+                stats['abandoned'] += 1
+                return
+            stats['requests'] += 1
+            stats['time'] += time
+            if ok:
+                stats['ok'] += 1
+
+    @classmethod
+    def get_client_stats(cls):
+        """
+        :return: dict keyed by client name, of the number of player requests
+                 completed, number of responses with a playable status, number
+                 of requests abandoned in flight, and total seconds taken by
+                 completed requests
+        """
+        with cls._client_stats_lock:
+            return {
+                client_name: dict(stats)
+                for client_name, stats in cls._client_stats.items()
+            }
 
     @staticmethod
     def _response_hook_json(**kwargs):
@@ -1348,7 +1603,129 @@ class StreamInfo(YouTubeRequestClient):
             return result['simpleText']
         return None
 
+    def _get_cache_key(self, video_id):
+        """
+        :return: stream cache key of the streams of the video for the current
+                 client config and settings, or None if the streams should not
+                 be cached, as the user is to be prompted for subtitles
+        """
+        context = self._context
+        settings = context.get_settings()
+        sub_selection = settings.get_subtitle_selection()
+        if (sub_selection == Subtitles.LANG_PROMPT
+                or context.get_ui().get_property(PLAY_PROMPT_SUBTITLES)):
+            return None
+        config = (
+            self._ask_for_quality,
+            self._audio_only,
+            self._use_mpd,
+            bool(self._access_token),
+            self._language_base,
+            get_connect_address(context, as_netloc=True),
+            settings.age_gate(),
+            settings.fixed_video_quality(),
+            settings.mpd_video_qualities(),
+            settings.stream_features(),
+            settings.stream_select(),
+            settings.use_isa(),
+            settings.use_remote_history(),
+            settings.subtitle_download(),
+            sub_selection,
+            settings.get_language(),
+            context.get_subtitle_language(),
+        )
+        return 'streams.{0}.{1}'.format(video_id, md5(json.dumps(
+            config, default=sorted
+        ).encode('utf-8')).hexdigest())
+
+    def _update_expiry(self, text):
+        """
+        Updates the time at which the streams expire with the earliest expire
+        parameter of the URLs in the given text
+        """
+        if not text:
+            return
+        for match in self._EXPIRE_RE.finditer(text):
+            expiry = int(match.group(1))
+            if not self._expiry or expiry < self._expiry:
+                self._expiry = expiry
+
+    def _get_cached_streams(self, stream_cache, cache_key):
+        """
+        :return: list of cached streams, or None if there are no cached streams
+                 that remain valid long enough to be played, or if the files
+                 they refer to no longer exist
+        """
+        cached = stream_cache.get_item(cache_key)
+        if not cached:
+            return None
+        if cached['expiry'] - self._cache_margin < time():
+            stream_cache.del_item(cache_key)
+            return None
+
+        streams = cached['streams']
+        for stream in streams:
+            for url in stream.get('meta', {}).get('subtitles') or ():
+                if not url.startswith('http') and not xbmcvfs.exists(url):
+                    return None
+
+        manifest = cached['manifest']
+        if manifest:
+            filename, output = manifest
+            filepath = os.path.join(self.BASE_PATH, filename)
+            try:
+                with xbmcvfs.File(filepath, 'w') as mpd_file:
+                    if not mpd_file.write(output):
+                        return None
+            except (IOError, OSError):
+                return None
+
+        cpn = self._generate_cpn()
+        for stream in streams:
+            playback_stats = stream.get('playback_stats')
+            if not playback_stats:
+                continue
+            for key, url in playback_stats.items():
+                if url:
+                    playback_stats[key] = '&cpn='.join((
+                        url.rpartition('&cpn=')[0], cpn
+                    ))
+        return streams
+
     def load_stream_info(self, video_id):
+        """
+        Loads the streams of a video, or uses the streams cached by a previous
+        load with the same config if their URLs have not yet expired. Live
+        streams are not cached.
+        :param str video_id: id of the video
+        :return: list of streams
+        """
+        self.video_id = video_id
+
+        cache_key = self._get_cache_key(video_id)
+        if cache_key:
+            stream_cache = self._context.get_stream_cache()
+            streams = self._get_cached_streams(stream_cache, cache_key)
+            if streams:
+                self._context.log_debug('StreamInfo.load_stream_info'
+                                        ' - Using cached streams'
+                                        '\n\tvideo_id: |{video_id}|'
+                                        .format(video_id=video_id))
+                return streams
+
+        self._expiry = None
+        self._manifest = None
+        streams = list(self._load_stream_info(video_id))
+
+        if cache_key and self._expiry:
+            stream_cache.set_item(cache_key, {
+                'expiry': self._expiry,
+                'streams': streams,
+                'manifest': self._manifest,
+            })
+        return streams
+
+    def _load_stream_info(self, video_id):
         self.video_id = video_id
 
         context = self._context
@@ -1398,139 +1775,147 @@ class StreamInfo(YouTubeRequestClient):
         access_token = self._access_token
         auth = False
 
-        for name, clients in self._client_groups.items():
-            if not clients:
-                continue
-            if name == 'mpd' and not use_mpd:
-                continue
-            if name == 'ask' and use_mpd and not ask_for_quality:
-                continue
-
-            status = None
+        client_groups = [
+            (name, clients)
+            for name, clients in self._client_groups.items()
+            if clients
+            and not (name == 'mpd' and not use_mpd)
+            and not (name == 'ask' and use_mpd and not ask_for_quality)
+        ]
+        # responses are still checked one client at a time, in order, but the
+        # requests for the clients that may be needed next are made ahead
+        player_requests = _PlayerRequests(
+            self,
+            video_info_url,
+            video_id,
+            [client_name
+             for _, clients in client_groups
+             for client_name in clients],
+            self._max_player_requests,
+        )
 
-            restart = False
-            while 1:
-                for client_name in clients:
-                    _client = self.build_client(client_name, client_data)
-                    if not _client:
-                        continue
+        try:
+            for name, clients in client_groups:
+                status = None
 
-                    _result = self.request(
-                        video_info_url,
-                        'POST',
-                        response_hook=self._response_hook_json,
-                        error_title='Player request failed',
-                        error_hook=self._error_hook,
-                        error_hook_kwargs={
-                            'video_id': video_id,
-                            'client': client_name,
-                            'auth': bool(_client.get('_access_token')),
-                        },
-                        **_client
-                    ) or {}
-
-                    video_details = _result.get('videoDetails', {})
-                    playability = _result.get('playabilityStatus', {})
-                    status = playability.get('status', 'ERROR').upper()
-                    reason = playability.get('reason', 'UNKNOWN')
-
-                    if (video_details
-                            and video_id != video_details.get('videoId')):
-                        status = 'CONTENT_NOT_AVAILABLE_IN_THIS_APP'
-                        reason = 'Watch on the latest version of YouTube'
-
-                    if (age_gate_enabled
-                            and playability.get('desktopLegacyAgeGateReason')):
-                        abort = True
-                        break
-                    elif status == 'LIVE_STREAM_OFFLINE':
-                        abort = True
-                        break
-                    elif status == 'OK':
-                        break
-                    elif status in {
-                        'AGE_CHECK_REQUIRED',
-                        'AGE_VERIFICATION_REQUIRED',
-                        'CONTENT_CHECK_REQUIRED',
-                        'LOGIN_REQUIRED',
-                        'CONTENT_NOT_AVAILABLE_IN_THIS_APP',
-                        'ERROR',
-                        'UNPLAYABLE',
-                    }:
-                        log_warning(
-                            'Failed to retrieve video info'
-                            '\n\tStatus:   {status}'
-                            '\n\tReason:   {reason}'
-                            '\n\tvideo_id: |{video_id}|'
-                            '\n\tClient:   |{client}|'
-                            '\n\tAuth:     |{auth}|'
-                            .format(
-                                status=status,
-                                reason=reason or 'UNKNOWN',
-                                video_id=video_id,
-                                client=_client['_name'],
-                                auth=auth,
-                            )
-                        )
-                        compare_reason = reason.lower()
-                        if any(why in compare_reason for why in reauth_reasons):
-                            if access_token and not auth:
-                                auth = True
-                                client_data['_access_token'] = access_token
-                                restart = True
-                            break
-                        if any(why in compare_reason for why in retry_reasons):
+                restart = False
+                while 1:
+                    for client_name in clients:
+                        _client, _result = player_requests.get(client_name,
+                                                               client_data)
+                        if not _client:
                             continue
-                        if any(why in compare_reason for why in skip_reasons):
+
+                        video_details = _result.get('videoDetails', {})
+                        playability = _result.get('playabilityStatus', {})
+                        status = playability.get('status', 'ERROR').upper()
+                        reason = playability.get('reason', 'UNKNOWN')
+
+                        if (video_details
+                                and video_id != video_details.get('videoId')):
+                            status = 'CONTENT_NOT_AVAILABLE_IN_THIS_APP'
+                            reason = 'Watch on the latest version of YouTube'
+
+                        if (age_gate_enabled
+                                and playability.get(
+                                    'desktopLegacyAgeGateReason'
+                                )):
+                            abort = True
                             break
-                        if any(why in compare_reason for why in abort_reasons):
+                        elif status == 'LIVE_STREAM_OFFLINE':
                             abort = True
                             break
+                        elif status == 'OK':
+                            break
+                        elif status in {
+                            'AGE_CHECK_REQUIRED',
+                            'AGE_VERIFICATION_REQUIRED',
+                            'CONTENT_CHECK_REQUIRED',
+                            'LOGIN_REQUIRED',
+                            'CONTENT_NOT_AVAILABLE_IN_THIS_APP',
+                            'ERROR',
+                            'UNPLAYABLE',
+                        }:
+                            log_warning(
+                                'Failed to retrieve video info'
+                                '\n\tStatus:   {status}'
+                                '\n\tReason:   {reason}'
+                                '\n\tvideo_id: |{video_id}|'
+                                '\n\tClient:   |{client}|'
+                                '\n\tAuth:     |{auth}|'
+                                .format(
+                                    status=status,
+                                    reason=reason or 'UNKNOWN',
+                                    video_id=video_id,
+                                    client=_client['_name'],
+                                    auth=auth,
+                                )
+                            )
+                            compare_reason = reason.lower()
+                            if any(why in compare_reason
+                                   for why in reauth_reasons):
+                                if access_token and not auth:
+                                    auth = True
+                                    client_data['_access_token'] = access_token
+                                    restart = True
+                                break
+                            if any(why in compare_reason
+                                   for why in retry_reasons):
+                                continue
+                            if any(why in compare_reason
+                                   for why in skip_reasons):
+                                break
+                            if any(why in compare_reason
+                                   for why in abort_reasons):
+                                abort = True
+                                break
+                        else:
+                            log_debug(
+                                'Unknown playabilityStatus in player response'
+                                '\n\tplayabilityStatus: {0}'
+                                .format(playability)
+                            )
                     else:
-                        log_debug(
-                            'Unknown playabilityStatus in player response'
-                            '\n\tplayabilityStatus: {0}'
-                            .format(playability)
-                        )
-                else:
-                    break
-                if not restart:
+                        break
+                    if not restart:
+                        break
+                    restart = False
+
+                if abort:
                     break
-                restart = False
 
-            if abort:
-                break
-
-            if status == 'OK':
-                log_debug(
-                    'Retrieved video info:'
-                    '\n\tvideo_id: |{video_id}|'
-                    '\n\tClient:   |{client}|'
-                    '\n\tAuth:     |{auth}|'
-                    .format(
-                        video_id=video_id,
-                        client=client_name,
-                        auth=bool(_client.get('_access_token')),
-                    )
-                )
-                if not self._selected_client:
-                    client = self._selected_client = _client.copy()
-                    result = _result
-                    video_details = result.get('videoDetails', {})
-                    playability = result.get('playabilityStatus', {})
-
-                _streaming_data = _result.get('streamingData', {})
-                if audio_only or ask_for_quality or not use_mpd:
-                    progressive_fmts.extend(
-                        _streaming_data.get('formats', [])
-                    )
-                if use_mpd:
-                    adaptive_fmts.extend(
-                        _streaming_data.get('adaptiveFormats', [])
+                if status == 'OK':
+                    log_debug(
+                        'Retrieved video info:'
+                        '\n\tvideo_id: |{video_id}|'
+                        '\n\tClient:   |{client}|'
+                        '\n\tAuth:     |{auth}|'
+                        .format(
+                            video_id=video_id,
+                            client=client_name,
+                            auth=bool(_client.get('_access_token')),
+                        )
                     )
-                if 'hlsManifestUrl' in _streaming_data:
-                    hls_playlists.append(_streaming_data['hlsManifestUrl'])
-                streaming_data.update(_streaming_data)
+                    if not self._selected_client:
+                        client = self._selected_client = _client.copy()
+                        result = _result
+                        video_details = result.get('videoDetails', {})
+                        playability = result.get('playabilityStatus', {})
+
+                    _streaming_data = _result.get('streamingData', {})
+                    if audio_only or ask_for_quality or not use_mpd:
+                        progressive_fmts.extend(
+                            _streaming_data.get('formats', [])
+                        )
+                    if use_mpd:
+                        adaptive_fmts.extend(
+                            _streaming_data.get('adaptiveFormats', [])
+                        )
+                    if 'hlsManifestUrl' in _streaming_data:
+                        hls_playlists.append(_streaming_data['hlsManifestUrl'])
+                    streaming_data.update(_streaming_data)
+        finally:
+            player_requests.close()
 
         if not self._selected_client:
             if status == 'LIVE_STREAM_OFFLINE':
@@ -1789,6 +2174,20 @@ class StreamInfo(YouTubeRequestClient):
         if not stream_list:
             raise YouTubeException('No streams found')
 
+        # Live streams are not cached, see load_stream_info
+        if is_live:
+            self._expiry = None
+        else:
+            if streaming_data.get('expiresInSeconds'):
+                self._expiry = (int(time())
+                                + int(streaming_data['expiresInSeconds']))
+            for stream in stream_list.values():
+                self._update_expiry(stream.get('url'))
+            for url in meta_info.get('subtitles') or ():
+                self._update_expiry(url)
+            if self._manifest:
+                self._update_expiry(self._manifest[1])
+
         return stream_list.values()
 
     def _process_stream_data(self, stream_data, default_lang_code='und'):
@@ -2393,6 +2792,7 @@ class StreamInfo(YouTubeRequestClient):
                       .format(exc=exc, filepath=filepath))
             success = False
         if success:
+            self._manifest = (filename, output)
             return urlunsplit((
                 'http',
                 get_connect_address(context, as_netloc=True),
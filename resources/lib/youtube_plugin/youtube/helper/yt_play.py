@@ -37,6 +37,55 @@ from ...kodion.network import get_connect_address
 from ...kodion.utils import find_video_id, select_stream
 
 
+def _get_stream_options(context, screensaver=False, overrides=True):
+    """
+    Derives the options used to load and select the streams of a video
+    :param screensaver: True if the video is played by the screensaver
+    :param overrides: True to use, and clear, the quality prompt and forced
+                      audio overrides set for the play request
+    :return: dict of options
+    """
+    ui = context.get_ui()
+    settings = context.get_settings()
+
+    is_external = ui.get_property(PLAY_WITH)
+    options = {
+        'is_external': is_external,
+        'web_urls': ((is_external and settings.alternative_player_web_urls())
+                     or settings.default_player_web_urls()),
+        'ask_for_quality': False,
+        'audio_only': False,
+        'use_adaptive_formats': False,
+        'use_mpd': False,
+    }
+    if options['web_urls']:
+        return options
+
+    ask_for_quality = settings.ask_for_video_quality()
+    if (overrides
+            and ui.pop_property(PLAY_PROMPT_QUALITY)
+            and not screensaver):
+        ask_for_quality = True
+        audio_only = False
+    elif overrides and ui.pop_property(PLAY_FORCE_AUDIO):
+        audio_only = True
+    else:
+        audio_only = settings.audio_only()
+    use_adaptive_formats = (not is_external
+                            or settings.alternative_player_adaptive())
+    use_mpd = (use_adaptive_formats
+               and settings.use_mpd_videos()
+               and context.wakeup(SERVER_WAKEUP, timeout=5))
+
+    options.update(
+        ask_for_quality=ask_for_quality,
+        audio_only=audio_only,
+        use_adaptive_formats=use_adaptive_formats,
+        use_mpd=use_mpd,
+    )
+    return options
+
+
 def _play_stream(provider, context):
     ui = context.get_ui()
     params = context.get_params()
@@ -52,26 +101,17 @@ def _play_stream(provider, context):
     incognito = params.get('incognito', False)
     screensaver = params.get('screensaver', False)
 
-    audio_only = False
-    is_external = ui.get_property(PLAY_WITH)
-    if ((is_external and settings.alternative_player_web_urls())
-            or settings.default_player_web_urls()):
+    options = _get_stream_options(context, screensaver=screensaver)
+    is_external = options['is_external']
+    audio_only = options['audio_only']
+    if options['web_urls']:
         stream = {
             'url': 'https://youtu.be/{0}'.format(video_id),
         }
     else:
-        ask_for_quality = settings.ask_for_video_quality()
-        if ui.pop_property(PLAY_PROMPT_QUALITY) and not screensaver:
-            ask_for_quality = True
-        elif ui.pop_property(PLAY_FORCE_AUDIO):
-            audio_only = True
-        else:
-            audio_only = settings.audio_only()
-        use_adaptive_formats = (not is_external
-                                or settings.alternative_player_adaptive())
-        use_mpd = (use_adaptive_formats
-                   and settings.use_mpd_videos()
-                   and context.wakeup(SERVER_WAKEUP, timeout=5))
+        ask_for_quality = options['ask_for_quality']
+        use_adaptive_formats = options['use_adaptive_formats']
+        use_mpd = options['use_mpd']
 
         try:
             streams = client.get_streams(
@@ -179,6 +219,36 @@ def _play_stream(provider, context):
     return media_item
 
 
+def preload_streams(provider, context, video_id):
+    """
+    Loads the streams of a video ahead of it being played, with the options
+    that _play_stream uses when there are no overrides for the play request,
+    so that the streams, subtitles and MPEG-DASH manifest are cached by
+    StreamInfo.load_stream_info for when the video is played.
+    :return: True if the streams were loaded, False otherwise
+    """
+    options = _get_stream_options(context, overrides=False)
+    if options['web_urls']:
+        return False
+
+    client = provider.get_client(context)
+    try:
+        streams = client.get_streams(
+            context,
+            video_id=video_id,
+            ask_for_quality=options['ask_for_quality'],
+            audio_only=options['audio_only'],
+            use_mpd=options['use_mpd'],
+        )
+    except YouTubeException as exc:
+        context.log_warning('yt_play.preload_streams - Error'
+                            '\n\tvideo_id:  |{video_id}|'
+                            '\n\tException: {exc!r}'
+                            .format(video_id=video_id, exc=exc))
+        return False
+    return bool(streams)
+
+
 def _play_playlist(provider, context):
     video_items = []
     params = context.get_params()
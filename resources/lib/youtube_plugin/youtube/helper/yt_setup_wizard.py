@@ -229,6 +229,7 @@ def process_old_search_db(context, step, steps, **_kwargs):
             migrate='storage',
         )
         items = old_search_db.get_items(process=_convert_old_search_item)
+        old_search_db.close()
         for search in items:
             search_history.update_item(search['text'], search['timestamp'])
 
@@ -277,6 +278,7 @@ def process_old_history_db(context, step, steps, **_kwargs):
             migrate='storage',
         )
         items = old_history_db.get_items(process=_convert_old_history_item)
+        old_history_db.close()
         for video_id, history in items.items():
             timestamp = history.pop('timestamp', None)
             playback_history.update_item(video_id, history, timestamp)
@@ -100,9 +100,15 @@ def _process_recommendations(provider, context, client):
 
 def _process_trending(provider, context, client):
     context.set_content(CONTENT.VIDEO_CONTENT)
+    params = context.get_params()
+    function_cache = context.get_function_cache()
 
-    json_data = client.get_trending_videos(
-        page_token=context.get_param('page_token', '')
+    json_data = function_cache.run(
+        client.get_trending_videos,
+        function_cache.ONE_HOUR,
+        _refresh=params.get('refresh'),
+        _stale_ok=function_cache.ONE_DAY,
+        page_token=params.get('page_token', ''),
     )
 
     if not json_data:
@@ -120,7 +126,8 @@ def _process_browse_channels(provider, context, client):
         function_cache = context.get_function_cache()
         json_data = function_cache.run(client.get_guide_categories,
                                        function_cache.ONE_MONTH,
-                                       _refresh=context.get_param('refresh'))
+                                       _refresh=context.get_param('refresh'),
+                                       _stale_ok=True)
 
     if not json_data:
         return False
@@ -310,7 +317,8 @@ def _process_my_subscriptions(provider, context, client, filtered=False):
     ) as progress_dialog:
         params = context.get_params()
         json_data = client.get_my_subscriptions(
-            page_token=params.get('page', 1),
+            page_token=params.get('page_token'),
+            page=params.get('page', 1),
             logged_in=provider.is_logged_in(),
             do_filter=filtered,
             refresh=params.get('refresh'),
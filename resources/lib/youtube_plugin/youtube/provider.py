@@ -312,6 +312,9 @@ class Provider(AbstractProvider):
         self._client = client
         return self._client
 
+    def preload_streams(self, context, video_id):
+        return yt_play.preload_streams(self, context, video_id)
+
     def get_resource_manager(self, context):
         resource_manager = self._resource_manager
         if not resource_manager or resource_manager.context_changed(context):
@@ -580,6 +583,7 @@ class Provider(AbstractProvider):
             json_data = function_cache.run(client.get_channel_by_identifier,
                                            function_cache.ONE_DAY,
                                            _refresh=params.get('refresh'),
+                                           _stale_ok=True,
                                            **identifier)
             if not json_data:
                 return False